@@ -0,0 +1,169 @@
+"""
+Request coalescing and admission control for upstream calls
+SingleFlight shares one in-flight call between identical concurrent requests;
+Limiter caps concurrent upstream calls per provider with a bounded wait queue
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+# Seconds a request may wait in a limiter queue before it is shed
+QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+
+# (max concurrent, max queued) per limiter; override with <NAME>_MAX_CONCURRENCY / <NAME>_MAX_QUEUE
+DEFAULT_LIMITS = {
+    'embeddings': (16, 64),
+    'chat': (8, 16)
+}
+
+
+class Overloaded(Exception):
+    """Raised when a limiter's queue is full or the wait timed out"""
+
+    def __init__(self, name, reason):
+        super().__init__(f"{name} overloaded: {reason}")
+        self.name = name
+        self.retry_after = max(1, int(QUEUE_TIMEOUT))
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent do(key, fn) calls with the same key run fn once and share its result
+
+    Followers wait at most `timeout` seconds for the leader, like a limiter
+    queue, so a hung upstream call cannot hold every identical request.
+    """
+
+    def __init__(self, name='singleflight', timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.event.wait(self.timeout):
+                raise Overloaded(self.name, 'timed out waiting for an identical in-flight call')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class Slot:
+    """A held limiter slot; release() is idempotent so it can be wired to several cleanup paths"""
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release()
+
+
+class Limiter:
+    """Concurrency limit with a bounded wait queue; sheds load with Overloaded instead of piling up"""
+
+    def __init__(self, name, max_concurrent, max_queue, timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._sem = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self) -> Slot:
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded(self.name, 'queue full')
+                self.waiting += 1
+            try:
+                acquired = self._sem.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise Overloaded(self.name, 'timed out waiting for a slot')
+        with self._lock:
+            self.active += 1
+        return Slot(self)
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+        self._sem.release()
+
+    @contextmanager
+    def slot(self):
+        held = self.acquire()
+        try:
+            yield held
+        finally:
+            held.release()
+
+    def stats(self):
+        return {'active': self.active, 'waiting': self.waiting, 'rejected': self.rejected,
+                'max_concurrent': self.max_concurrent, 'max_queue': self.max_queue}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, kind=None) -> Limiter:
+    """
+    Shared limiter for an upstream (e.g. 'embeddings', 'chat_grok')
+
+    Limits come from <NAME>_MAX_CONCURRENCY / <NAME>_MAX_QUEUE, falling back to
+    the DEFAULT_LIMITS entry for kind (or name).
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            max_concurrent, max_queue = DEFAULT_LIMITS.get(kind or name, DEFAULT_LIMITS['chat'])
+            prefix = name.upper()
+            limiter = _limiters[name] = Limiter(
+                name,
+                int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", max_concurrent)),
+                int(os.environ.get(f"{prefix}_MAX_QUEUE", max_queue))
+            )
+        return limiter
+
+
+def stats():
+    with _limiters_lock:
+        return {name: limiter.stats() for name, limiter in _limiters.items()}
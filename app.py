@@ -1,6 +1,15 @@
 from flask import Flask, render_template, request, Response, jsonify, session  # type: ignore
+from werkzeug.exceptions import RequestEntityTooLarge  # type: ignore
+import base64
+import gc
 import json
 import os
+import threading
+import time
+import admission
+import conversation
+import metrics
+import sse
 from search import SemanticSearch
 
 try:
@@ -16,32 +25,124 @@ except ImportError:
     print("OpenAI library not found. Installing...")
     OpenAI = None
 
-try:
-    import PyPDF2  # type: ignore
-except ImportError:
-    print("PyPDF2 not found")
-    PyPDF2 = None
+from extract import extract_text, ExtractionError, PyPDF2, docx, MAX_UPLOAD_BYTES
 
-try:
-    import docx  # type: ignore
-except ImportError:
+if not PyPDF2:
+    print("PyPDF2 not found")
+if not docx:
     print("python-docx not found")
-    docx = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SESSION_SECRET', os.urandom(24))
+# Enforced by werkzeug while reading the body, so it also covers chunked uploads
+# that carry no Content-Length (64 KB slack for multipart headers)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json')
+EMBEDDINGS_PATH = os.environ.get('EMBEDDINGS_PATH', 'data/position_embeddings.pkl')
+
+# Search index and KIRE are built by warm_up(), not at import time, so the
+# server can bind immediately even when embeddings must be regenerated.
+RELATED_PATH = os.environ.get('RELATED_PATH', 'data/related_positions.npz')
+POSITION_STORE_PATH = os.environ.get('POSITION_STORE_PATH', 'data/positions.sqlite3')
+RULES_PATH = os.environ.get('RULES_PATH', 'kuczynski_rules_full.json')
+MAX_IDS_PER_REQUEST = 100
+EXPORT_MAX_LIMIT = 5000
+
+searcher = None
+kire = None
+position_store = None
+# Per-session retrieval context for follow-up questions (see conversation.py)
+retrieval_contexts = conversation.ContextCache()
+warmup_status = {'store': 'pending', 'searcher': 'pending', 'kire': 'pending', 'error': None}
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+def warm_up():
+    """Build the position store, semantic search index and KIRE (blocking)"""
+    global searcher, kire, position_store
+    # Store first: it is quick to build and serves /api/positions while embeddings load
+    if position_store is None:
+        warmup_status['store'] = 'loading'
+        try:
+            from position_store import PositionStore
+            position_store = PositionStore.open(DATABASE_PATH, POSITION_STORE_PATH, RULES_PATH)
+            warmup_status['store'] = 'ready'
+        except Exception as e:
+            print(f"✗ Could not open position store: {e}")
+            warmup_status['store'] = 'failed'
 
-print("Initializing semantic search...")
-searcher = SemanticSearch('data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json', 'data/position_embeddings.pkl')
-
-# Initialize KIRE (Kuczynski Inference Rule Engine)
-print("Initializing KIRE...")
-try:
-    from kuczynski_engine import KuczynskiEngine
-    kire = KuczynskiEngine()
-except Exception as e:
-    print(f"✗ Could not initialize KIRE: {e}")
-    kire = None
+    if searcher is None:
+        print("Initializing semantic search...")
+        warmup_status['searcher'] = 'loading'
+        try:
+            index = SemanticSearch(DATABASE_PATH, EMBEDDINGS_PATH)
+            try:
+                from related import RelatedGraph
+                index.graph = RelatedGraph.load(RELATED_PATH, index.positions)
+            except Exception as e:
+                print(f"✗ Could not load related-positions graph: {e}")
+            searcher = index
+            warmup_status['searcher'] = 'ready'
+        except Exception as e:
+            print(f"✗ Could not initialize semantic search: {e}")
+            warmup_status['searcher'] = 'failed'
+            warmup_status['error'] = str(e)
+
+    # Initialize KIRE (Kuczynski Inference Rule Engine)
+    if kire is None:
+        print("Initializing KIRE...")
+        warmup_status['kire'] = 'loading'
+        try:
+            from kuczynski_engine import KuczynskiEngine
+            kire = KuczynskiEngine(RULES_PATH)
+            warmup_status['kire'] = 'ready'
+        except Exception as e:
+            print(f"✗ Could not initialize KIRE: {e}")
+            warmup_status['kire'] = 'failed'
+
+def start_warm_up():
+    """Start warm_up() in a background thread (idempotent)"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None and searcher is None:
+            _warmup_thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+            _warmup_thread.start()
+
+# Models offered per chat provider (also the only model values used as metric labels)
+PROVIDER_MODELS = {
+    'grok': ['grok-2-latest', 'grok-2-vision-1212', 'grok-vision-beta'],
+    'anthropic': ['claude-sonnet-4-20250514', 'claude-opus-4-20250514'],
+    'openai': ['gpt-4o', 'gpt-4o-mini', 'o1', 'o1-mini'],
+    'deepseek': ['deepseek-chat', 'deepseek-reasoner'],
+    'perplexity': ['llama-3.1-sonar-large-128k-online', 'llama-3.1-sonar-small-128k-online']
+}
+CHAT_PROVIDERS = tuple(PROVIDER_MODELS)
+
+def metric_labels(provider, model, mode):
+    """Bounded (provider, model, mode) labels: request values are never used verbatim"""
+    if not model:
+        model_label = 'default'
+    elif model in PROVIDER_MODELS.get(provider, ()):
+        model_label = model
+    else:
+        model_label = 'other'
+    return provider, model_label, 'enhanced' if mode == 'enhanced' else 'basic'
+
+def overloaded_response(e):
+    """Fast 503 when an upstream limiter sheds load"""
+    response = jsonify({'error': 'Server busy', 'message': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def is_ready():
+    return searcher is not None
+
+def warming_up_response():
+    """503 returned by endpoints that need the search index before it is ready"""
+    if warmup_status['searcher'] == 'failed':
+        return jsonify({'error': 'Search index unavailable', 'message': warmup_status['error']}), 503
+    return jsonify({'error': 'Service warming up', 'message': 'Search index is still loading, retry shortly'}), 503
 
 anthropic_client = None
 openai_client = None
@@ -98,49 +199,94 @@ try:
 except Exception as e:
     print(f"✗ Could not initialize Perplexity: {e}")
 
+@app.before_request
+def ensure_warm_up():
+    # Covers servers that import `app:app` directly instead of create_app()
+    start_warm_up()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.after_request
+def add_server_timing(response):
+    """Expose per-stage timings on JSON responses (SSE streams finish after headers are sent)"""
+    timer = metrics.current_timer()
+    if timer and timer.timings and response.mimetype == 'application/json':
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint for per-stage latency histograms"""
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the search index is loaded (KIRE is optional)"""
+    body = {
+        'ready': is_ready(),
+        'store': warmup_status['store'],
+        'searcher': warmup_status['searcher'],
+        'kire': warmup_status['kire'],
+        'positions': len(searcher.positions) if searcher else 0,
+        'limiters': admission.stats()
+    }
+    if warmup_status['error']:
+        body['error'] = warmup_status['error']
+    return jsonify(body), 200 if is_ready() else 503
+
 @app.route('/api/providers', methods=['GET'])
 def get_providers():
     """Return available AI providers"""
     providers = []
     if grok_client:
-        providers.append({'id': 'grok', 'name': 'Grok (xAI)', 'models': ['grok-2-latest', 'grok-2-vision-1212', 'grok-vision-beta']})
+        providers.append({'id': 'grok', 'name': 'Grok (xAI)', 'models': PROVIDER_MODELS['grok']})
     if anthropic_client:
-        providers.append({'id': 'anthropic', 'name': 'Anthropic Claude', 'models': ['claude-sonnet-4-20250514', 'claude-opus-4-20250514']})
+        providers.append({'id': 'anthropic', 'name': 'Anthropic Claude', 'models': PROVIDER_MODELS['anthropic']})
     if openai_client:
-        providers.append({'id': 'openai', 'name': 'OpenAI', 'models': ['gpt-4o', 'gpt-4o-mini', 'o1', 'o1-mini']})
+        providers.append({'id': 'openai', 'name': 'OpenAI', 'models': PROVIDER_MODELS['openai']})
     if deepseek_client:
-        providers.append({'id': 'deepseek', 'name': 'DeepSeek', 'models': ['deepseek-chat', 'deepseek-reasoner']})
+        providers.append({'id': 'deepseek', 'name': 'DeepSeek', 'models': PROVIDER_MODELS['deepseek']})
     if perplexity_client:
-        providers.append({'id': 'perplexity', 'name': 'Perplexity', 'models': ['llama-3.1-sonar-large-128k-online', 'llama-3.1-sonar-small-128k-online']})
+        providers.append({'id': 'perplexity', 'name': 'Perplexity', 'models': PROVIDER_MODELS['perplexity']})
     return jsonify({'providers': providers})
 
+def require_internal_auth():
+    """None if the request carries ZHI_PRIVATE_KEY, otherwise the error response to return"""
+    # Authentication: Check Authorization header
+    auth_header = request.headers.get('Authorization', '')
+    
+    # Get the private key from environment
+    zhi_private_key = os.environ.get('ZHI_PRIVATE_KEY', '')
+    
+    if not zhi_private_key:
+        return jsonify({'error': 'Server authentication not configured'}), 500
+    
+    # Check if Authorization header is present and valid
+    # Support both "Bearer <token>" and direct token
+    if auth_header.startswith('Bearer '):
+        provided_key = auth_header[7:]  # Remove "Bearer " prefix
+    else:
+        provided_key = auth_header
+    
+    # Verify authentication
+    if not provided_key or provided_key != zhi_private_key:
+        return jsonify({'error': 'Unauthorized', 'message': 'Invalid or missing authentication key'}), 401
+    return None
+
 @app.route('/api/internal/knowledge', methods=['POST'])
 def internal_knowledge():
     """Secure internal API for knowledge queries - requires ZHI_PRIVATE_KEY authentication"""
     try:
-        # Authentication: Check Authorization header
-        auth_header = request.headers.get('Authorization', '')
-        
-        # Get the private key from environment
-        zhi_private_key = os.environ.get('ZHI_PRIVATE_KEY', '')
-        
-        if not zhi_private_key:
-            return jsonify({'error': 'Server authentication not configured'}), 500
-        
-        # Check if Authorization header is present and valid
-        # Support both "Bearer <token>" and direct token
-        if auth_header.startswith('Bearer '):
-            provided_key = auth_header[7:]  # Remove "Bearer " prefix
-        else:
-            provided_key = auth_header
-        
-        # Verify authentication
-        if not provided_key or provided_key != zhi_private_key:
-            return jsonify({'error': 'Unauthorized', 'message': 'Invalid or missing authentication key'}), 401
+        auth_error = require_internal_auth()
+        if auth_error:
+            return auth_error
         
         # Parse request body
         data = request.json
@@ -153,14 +299,28 @@ def internal_knowledge():
         if not query:
             return jsonify({'error': 'Invalid request', 'message': 'Query parameter required'}), 400
         
+        try:
+            expand = min(max(int(data.get('expand', 0) or 0), 0), 5)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid request', 'message': 'expand must be an integer between 0 and 5'}), 400
+        
+        if not is_ready():
+            return warming_up_response()
+        
+        timer = metrics.start_request(provider='internal', mode='knowledge')
+        
         # Search the knowledge base
-        search_results = searcher.search(query, top_k=5)
+        try:
+            search_results = searcher.search(query, top_k=5, expand=expand)
+        except admission.Overloaded as e:
+            return overloaded_response(e)
         
         # Run KIRE inference if available
         kire_results = []
         if kire:
             try:
-                fired_rules = kire.deduce(query, max_rules=10)
+                with timer.stage('kire_deduce'):
+                    fired_rules = kire.deduce(query, max_rules=10)
                 kire_results = [
                     {
                         'id': r['id'],
@@ -185,6 +345,8 @@ def internal_knowledge():
                 'domain': result.get('domain', ''),
                 'similarity_score': result.get('similarity', 0.0)
             })
+            if 'related_to' in result:
+                positions[-1]['related_to'] = result['related_to']
         
         # Construct comprehensive result
         result_text = f"Query: {query}\n\n"
@@ -227,6 +389,191 @@ def internal_knowledge():
         print(f"Internal knowledge API error: {e}")
         return jsonify({'error': 'Internal server error', 'message': str(e)}), 500
 
+def store_unavailable_response():
+    if warmup_status['store'] == 'failed':
+        return jsonify({'error': 'Position store unavailable'}), 503
+    return jsonify({'error': 'Service warming up', 'message': 'Position store is still loading, retry shortly'}), 503
+
+@app.route('/api/positions/<position_id>', methods=['GET'])
+def get_position(position_id):
+    """Resolve a single position id (e.g. a citation from the sources event)"""
+    if position_store is None:
+        return store_unavailable_response()
+    position = position_store.get(position_id)
+    if position is None:
+        return jsonify({'error': 'Not found', 'message': f'Unknown position: {position_id}'}), 404
+    return jsonify(position)
+
+@app.route('/api/positions', methods=['GET', 'POST'])
+def get_positions():
+    """
+    Multi-id fetch: GET ?ids=EP-001,EP-002 or POST {"ids": [...]} (max 100 ids).
+    Without ids, lists positions filtered by ?domain= and/or ?work= (paged with limit/offset).
+    """
+    if position_store is None:
+        return store_unavailable_response()
+    
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            return jsonify({'error': 'Invalid request', 'message': 'JSON body must be an object'}), 400
+        ids = body.get('ids', [])
+        if not isinstance(ids, list):
+            return jsonify({'error': 'Invalid request', 'message': 'ids must be a list'}), 400
+    else:
+        ids = [i for i in request.args.get('ids', '').split(',') if i.strip()]
+    ids = [str(i).strip() for i in ids]
+    
+    if ids:
+        if len(ids) > MAX_IDS_PER_REQUEST:
+            return jsonify({'error': 'Invalid request', 'message': f'At most {MAX_IDS_PER_REQUEST} ids per request'}), 400
+        positions, missing = position_store.get_many(ids)
+        return jsonify({'positions': positions, 'missing': missing})
+    
+    domain = request.args.get('domain')
+    work = request.args.get('work')
+    if not domain and not work:
+        return jsonify({'error': 'Invalid request', 'message': 'Provide ids, domain or work'}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    positions = position_store.find(domain=domain, work=work, limit=limit, offset=offset)
+    return jsonify({'positions': positions, 'limit': limit, 'offset': offset})
+
+@app.route('/api/positions/<position_id>/related', methods=['GET'])
+def related_positions(position_id):
+    """Precomputed nearest neighbours of a position (no embedding or network calls)"""
+    if not is_ready():
+        return warming_up_response()
+    if searcher.graph is None:
+        return jsonify({'error': 'Related-positions graph not available', 'message': 'Run `python related.py` to build it'}), 503
+    
+    limit = min(max(request.args.get('limit', 10, type=int), 1), searcher.graph.indices.shape[1])
+    related = searcher.graph.related(position_id, limit)
+    if related is None:
+        return jsonify({'error': 'Not found', 'message': f'Unknown position: {position_id}'}), 404
+    
+    index_by_id = searcher.graph.index_by_id
+    return jsonify({
+        'position_id': position_id,
+        'related': [
+            {
+                'position_id': pid,
+                'title': searcher.positions[index_by_id[pid]].get('title', ''),
+                'domain': searcher.positions[index_by_id[pid]].get('domain', ''),
+                'similarity': round(score, 4)
+            }
+            for pid, score in related
+        ]
+    })
+
+def encode_export_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_export_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+
+@app.route('/api/internal/export', methods=['GET'])
+def internal_export():
+    """
+    Streaming NDJSON export of positions and KIRE rules for mirrors - requires ZHI_PRIVATE_KEY
+
+    One JSON record per line, then a final {"type": "page"} line with next_cursor
+    (null on the last page) and the store's sync_token. Pass that token back as
+    ?since= on the next sync to receive only records changed (and tombstones for
+    records removed) after it; a token from another store history gets 410 and
+    the mirror must re-export everything.
+    """
+    auth_error = require_internal_auth()
+    if auth_error:
+        return auth_error
+    if position_store is None:
+        return store_unavailable_response()
+    
+    from position_store import EXPORT_KINDS, ResyncRequired
+    store = position_store
+    sync_token = store.sync_token
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), EXPORT_MAX_LIMIT)
+    include_embeddings = request.args.get('embeddings', '').lower() in ('1', 'true', 'yes')
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            state = decode_export_cursor(cursor)
+            kinds, since_token, kind_index, after = state['kinds'], state['s'], int(state['k']), int(state['a'])
+        except Exception:
+            return jsonify({'error': 'Invalid request', 'message': 'Malformed cursor'}), 400
+        if state.get('v') != sync_token:
+            restart = f" with since={since_token}" if since_token else ''
+            return jsonify({'error': 'Conflict', 'message': f"Data changed during export; restart{restart}",
+                            'sync_token': sync_token}), 409
+    else:
+        since_token = request.args.get('since') or None
+        requested = request.args.get('kinds', 'position,rule')
+        kinds = [k.strip() for k in requested.split(',') if k.strip()]
+        if since_token and 'deleted' not in kinds:
+            kinds.append('deleted')
+        kind_index, after = 0, -1
+    
+    since = 0
+    if since_token:
+        try:
+            since = store.since_version(since_token)
+        except ValueError:
+            return jsonify({'error': 'Invalid request', 'message': 'since must be a sync_token from a previous export'}), 400
+        except ResyncRequired as e:
+            return jsonify({'error': 'Full resync required', 'message': str(e), 'sync_token': sync_token}), 410
+    if not kinds or any(k not in EXPORT_KINDS for k in kinds):
+        return jsonify({'error': 'Invalid request', 'message': f'kinds must be drawn from {list(EXPORT_KINDS)}'}), 400
+    
+    if include_embeddings and not is_ready():
+        return warming_up_response()
+    index = searcher if include_embeddings else None
+    
+    def remaining(kind_index, after):
+        # A page that ends exactly on the last record must not hand out a cursor to an empty page
+        for k in range(kind_index, len(kinds)):
+            rows = store.export(kinds[k], after if k == kind_index else -1, since, 1)
+            try:
+                if next(rows, None) is not None:
+                    return True
+            finally:
+                rows.close()
+        return False
+    
+    def generate():
+        # Rows stream straight from SQLite cursors: memory stays constant per page
+        nonlocal kind_index, after
+        emitted = 0
+        while kind_index < len(kinds) and emitted < limit:
+            kind = kinds[kind_index]
+            for ordinal, record in store.export(kind, after, since, limit - emitted):
+                if index is not None and kind == 'position':
+                    row = index.index_by_id.get(record['id'])
+                    if row is not None:
+                        record['embedding'] = index.export_embedding(row)
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+                after = ordinal
+                emitted += 1
+            if emitted < limit:
+                # This kind is exhausted, move on to the next one
+                kind_index += 1
+                after = -1
+        next_cursor = None
+        if remaining(kind_index, after):
+            next_cursor = encode_export_cursor({'v': sync_token, 'kinds': kinds, 's': since_token, 'k': kind_index, 'a': after})
+        yield json.dumps({'type': 'page', 'count': emitted, 'next_cursor': next_cursor, 'sync_token': sync_token,
+                          'version': store.sync_version, 'epoch': store.epoch, 'since': since_token,
+                          'database_version': store.meta.get('database_version', '')}) + '\n'
+    
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/raw_chain', methods=['POST'])
 def raw_chain():
     """DEBUG ENDPOINT: Show raw KIRE inference chain that fired"""
@@ -239,10 +586,14 @@ def raw_chain():
             return jsonify({'error': 'No phenomenon provided'}), 400
         
         if not kire:
+            if warmup_status['kire'] in ('pending', 'loading'):
+                return jsonify({'error': 'KIRE warming up'}), 503
             return jsonify({'error': 'KIRE not initialized'}), 500
         
         # Run KIRE
-        fired_rules = kire.deduce(phenomenon, max_rules=max_rules)
+        timer = metrics.start_request(provider='internal', mode='raw_chain')
+        with timer.stage('kire_deduce'):
+            fired_rules = kire.deduce(phenomenon, max_rules=max_rules)
         
         # Format response
         response = {
@@ -269,6 +620,7 @@ def raw_chain():
 @app.route('/api/ask', methods=['POST'])
 def ask():
     """Handle user question with streaming response"""
+    chat_slot = None
     try:
         data = request.json
         question = data.get('question', '')
@@ -282,151 +634,173 @@ def ask():
         if not question:
             return jsonify({'error': 'No question provided'}), 400
         
-        # STEP 1: Run KIRE to get inference chain
-        kire_deductions = []
-        if kire:
-            try:
-                print("Running KIRE inference engine...")
-                kire_deductions = kire.deduce(question, max_rules=18)
-                print(f"KIRE fired {len(kire_deductions)} inference rules")
-            except Exception as e:
-                print(f"KIRE inference failed: {e}")
+        if provider not in CHAT_PROVIDERS:
+            return jsonify({'error': f'Unknown provider: {provider}'}), 400
+        
+        if not is_ready():
+            return warming_up_response()
+        
+        timer = metrics.start_request(*metric_labels(provider, model, mode))
+        
+        # Reserve a provider slot up front so overload is shed before any upstream work
+        try:
+            chat_slot = admission.get_limiter(f"chat_{provider}", kind='chat').acquire()
+        except admission.Overloaded as e:
+            return overloaded_response(e)
         
-        # STEP 2: Search for relevant positions
+        # STEP 1 + 2: KIRE inference chain and relevant positions, reusing this
+        # session's previous turn when the question is a follow-up
         print("Searching for relevant positions...")
+        context_key = conversation.session_key(session)
         try:
-            relevant_positions = searcher.search(question, top_k=7)
-            print(f"Found {len(relevant_positions)} relevant positions")
+            relevant_positions, kire_deductions, context, strategy = conversation.retrieve(
+                searcher, kire, question, retrieval_contexts.get(context_key), timer,
+                top_k=7, max_rules=18, follow_up=data.get('follow_up', True) is not False
+            )
+            retrieval_contexts.put(context_key, context)
+            print(f"Found {len(relevant_positions)} relevant positions ({strategy} retrieval)")
+        except admission.Overloaded as e:
+            if chat_slot:
+                chat_slot.release()
+            return overloaded_response(e)
         except Exception as e:
+            if chat_slot:
+                chat_slot.release()
             print(f"ERROR in search: {str(e)}")
             import traceback
             traceback.print_exc()
             return jsonify({'error': f'Search failed: {str(e)}'}), 500
         
+        # Once the provider stream is handed to sse.paced(), its helper releases the
+        # slot when the upstream connection closes (which can be after the client left)
+        streaming = False
+        
+        def release_unless_streaming():
+            if chat_slot and not streaming:
+                chat_slot.release()
+        
         def generate():
+            nonlocal streaming
+            stream_start = time.perf_counter()
+            batcher = sse.TokenBatcher()
             try:
                 print("Starting SSE generator...")
                 sources = [p['position_id'] for p in relevant_positions]
-                yield f"data: {json.dumps({'type': 'sources', 'data': sources})}\n\n"
+                yield sse.frame('sources', sources)
                 
                 # Build prompt with KIRE deductions integrated
-                if mode == 'enhanced':
-                    prompt = build_enhanced_prompt(question, relevant_positions, kire_deductions)
-                else:
-                    prompt = build_prompt(question, relevant_positions, kire_deductions)
+                with timer.stage('prompt_build'):
+                    if mode == 'enhanced':
+                        prompt = build_enhanced_prompt(question, relevant_positions, kire_deductions)
+                    else:
+                        prompt = build_prompt(question, relevant_positions, kire_deductions)
                 print(f"Generated prompt with KIRE integration, sending to {provider}...")
                 
-                if provider == 'grok':
-                    if not grok_client:
-                        yield f"data: {json.dumps({'type': 'error', 'data': 'Grok API key not configured'})}\n\n"
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-                    model_name = model or "grok-2-latest"
-                    print(f"Using Grok model: {model_name}")
-                    stream = grok_client.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt}],
-                        stream=True,
-                        max_tokens=2500
-                    )
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content:
-                            yield f"data: {json.dumps({'type': 'token', 'data': chunk.choices[0].delta.content})}\n\n"
-                
-                elif provider == 'anthropic':
-                    if not anthropic_client:
-                        yield f"data: {json.dumps({'type': 'error', 'data': 'Anthropic API key not configured'})}\n\n"
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-                    model_name = model or "claude-sonnet-4-20250514"
-                    print(f"Using Anthropic model: {model_name}")
-                    with anthropic_client.messages.stream(
-                        model=model_name,
-                        max_tokens=2500,
-                        messages=[{"role": "user", "content": prompt}]
-                    ) as stream:
-                        token_count = 0
-                        for text in stream.text_stream:
-                            token_count += 1
-                            if token_count % 10 == 0:
-                                print(f"Streamed {token_count} tokens...")
-                            yield f"data: {json.dumps({'type': 'token', 'data': text})}\n\n"
-                        print(f"Completed streaming {token_count} total tokens")
-                
-                elif provider == 'openai':
-                    if not openai_client:
-                        yield f"data: {json.dumps({'type': 'error', 'data': 'OpenAI API key not configured'})}\n\n"
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-                    model_name = model or "gpt-4o"
-                    stream = openai_client.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt}],
-                        stream=True,
-                        max_tokens=2500
-                    )
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content:
-                            yield f"data: {json.dumps({'type': 'token', 'data': chunk.choices[0].delta.content})}\n\n"
+                client, label, default_model = provider_client(provider)
+                if not client:
+                    yield sse.frame('error', f'{label} API key not configured')
+                    yield sse.DONE_FRAME
+                    return
+                model_name = model or default_model
+                print(f"Using {label} model: {model_name}")
                 
-                elif provider == 'deepseek':
-                    if not deepseek_client:
-                        yield f"data: {json.dumps({'type': 'error', 'data': 'DeepSeek API key not configured'})}\n\n"
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-                    model_name = model or "deepseek-chat"
-                    stream = deepseek_client.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt}],
-                        stream=True,
-                        max_tokens=2500
-                    )
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content:
-                            yield f"data: {json.dumps({'type': 'token', 'data': chunk.choices[0].delta.content})}\n\n"
+                provider_start = time.perf_counter()
+                if provider == 'anthropic':
+                    deltas = anthropic_deltas(client, model_name, prompt)
+                else:
+                    deltas = chat_deltas(client, model_name, prompt)
                 
-                elif provider == 'perplexity':
-                    if not perplexity_client:
-                        yield f"data: {json.dumps({'type': 'error', 'data': 'Perplexity API key not configured'})}\n\n"
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-                    model_name = model or "llama-3.1-sonar-large-128k-online"
-                    stream = perplexity_client.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt}],
-                        stream=True,
-                        max_tokens=2500
-                    )
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content:
-                            yield f"data: {json.dumps({'type': 'token', 'data': chunk.choices[0].delta.content})}\n\n"
+                stream = sse.paced(deltas, on_close=chat_slot.release if chat_slot else None)
+                streaming = True
                 
-                else:
-                    yield f"data: {json.dumps({'type': 'error', 'data': f'Unknown provider: {provider}'})}\n\n"
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                    return
+                # Hot path: no per-delta logging or json.dumps, frames are batched
+                for text in stream:
+                    if text is None:
+                        # Provider paused: don't hold buffered text for the whole pause
+                        frame = batcher.tick()
+                        if frame:
+                            yield frame
+                        continue
+                    if provider_start is not None:
+                        timer.observe('provider_ttft', time.perf_counter() - provider_start)
+                        provider_start = None
+                    frame = batcher.add(text)
+                    if frame:
+                        yield frame
+                frame = batcher.flush()
+                if frame:
+                    yield frame
+                print(f"Completed streaming {batcher.deltas} deltas in {batcher.frames} frames")
                 
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                yield sse.DONE_FRAME
             except Exception as e:
+                frame = batcher.flush()
+                if frame:
+                    yield frame
                 error_msg = f"Error: {str(e)}"
-                yield f"data: {json.dumps({'type': 'token', 'data': error_msg})}\n\n"
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                yield sse.token_frame(error_msg)
+                yield sse.DONE_FRAME
+            finally:
+                timer.observe('stream_total', time.perf_counter() - stream_start)
+                release_unless_streaming()
         
-        return Response(
+        response = Response(
             generate(), 
             mimetype='text/event-stream',
             headers={
                 'Cache-Control': 'no-cache',
                 'X-Accel-Buffering': 'no',
-                'Connection': 'keep-alive'
+                'Connection': 'keep-alive',
+                'X-Retrieval-Strategy': strategy
             }
         )
+        # Covers clients that disconnect before the generator starts
+        response.call_on_close(release_unless_streaming)
+        return response
     except Exception as e:
+        if chat_slot:
+            chat_slot.release()
         print(f"ERROR in /api/ask: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def provider_client(provider):
+    """(client, display name, default model) for a chat provider"""
+    if provider == 'grok':
+        return grok_client, 'Grok', "grok-2-latest"
+    if provider == 'anthropic':
+        return anthropic_client, 'Anthropic', "claude-sonnet-4-20250514"
+    if provider == 'openai':
+        return openai_client, 'OpenAI', "gpt-4o"
+    if provider == 'deepseek':
+        return deepseek_client, 'DeepSeek', "deepseek-chat"
+    if provider == 'perplexity':
+        return perplexity_client, 'Perplexity', "llama-3.1-sonar-large-128k-online"
+    return None, provider, ''
+
+def chat_deltas(client, model_name, prompt):
+    """Text deltas from an OpenAI-compatible streaming chat completion (Grok, OpenAI, DeepSeek, Perplexity)"""
+    stream = client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        max_tokens=2500
+    )
+    for chunk in stream:
+        content = chunk.choices[0].delta.content
+        if content:
+            yield content
+
+def anthropic_deltas(client, model_name, prompt):
+    """Text deltas from an Anthropic message stream"""
+    with client.messages.stream(
+        model=model_name,
+        max_tokens=2500,
+        messages=[{"role": "user", "content": prompt}]
+    ) as stream:
+        yield from stream.text_stream
+
 def build_prompt(question, positions, kire_deductions=[]):
     """Build intelligent prompt for Claude - BASIC MODE with KIRE integration"""
     
@@ -554,6 +928,7 @@ def login():
 def logout():
     """Logout user"""
     session.pop('username', None)
+    retrieval_contexts.discard(session.pop('retrieval_id', None))
     return jsonify({'success': True})
 
 @app.route('/api/check-session', methods=['GET'])
@@ -564,45 +939,53 @@ def check_session():
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Handle file uploads and extract text"""
+    """Handle file uploads and extract text (bounded to the first 10,000 characters)"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
+        # Oversized bodies are rejected by MAX_CONTENT_LENGTH: up front when
+        # Content-Length is sent, otherwise as soon as the stream passes the limit
+        try:
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file uploaded'}), 400
+        except RequestEntityTooLarge:
+            return jsonify({'error': f'File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)'}), 413
         
         file = request.files['file']
-        filename = file.filename.lower()
-        
-        if filename.endswith('.txt'):
-            text = file.read().decode('utf-8', errors='ignore')
-        elif filename.endswith('.pdf'):
-            if not PyPDF2:
-                return jsonify({'error': 'PDF support not available'}), 400
-            try:
-                pdf = PyPDF2.PdfReader(file)
-                text = '\n\n'.join([page.extract_text() for page in pdf.pages if page.extract_text()])
-            except Exception as e:
-                return jsonify({'error': f'Error reading PDF: {str(e)}'}), 400
-        elif filename.endswith(('.doc', '.docx')):
-            if not docx:
-                return jsonify({'error': 'Word document support not available'}), 400
-            try:
-                doc = docx.Document(file)
-                text = '\n\n'.join([para.text for para in doc.paragraphs if para.text.strip()])
-            except Exception as e:
-                return jsonify({'error': f'Error reading Word document: {str(e)}'}), 400
-        else:
-            return jsonify({'error': 'Unsupported file type. Please upload .txt, .pdf, or .docx'}), 400
+        try:
+            text = extract_text(file, file.filename or '')
+        except ExtractionError as e:
+            return jsonify({'error': str(e)}), e.status
         
-        return jsonify({'text': text[:10000]})
+        return jsonify({'text': text})
     except Exception as e:
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
+def create_app(warm=None):
+    """
+    App factory for gunicorn: `gunicorn 'app:create_app()'`
+
+    warm='background' (default) serves immediately and builds the index in a
+    background thread; /readyz reports 503 until it is done. warm='sync' builds
+    it before returning, which is what `--preload` wants: the master builds the
+    read-only index once and forked workers share it copy-on-write.
+    """
+    warm = warm or os.environ.get('APP_WARMUP', 'background')
+    if warm == 'sync':
+        warm_up()
+        # Move everything allocated so far out of GC tracking so collections in
+        # forked workers do not write to (and un-share) the inherited pages
+        gc.collect()
+        gc.freeze()
+    else:
+        start_warm_up()
+    return app
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
+    create_app()
     print("\n" + "="*60)
     print("  Ask a Philosopher - J.-M. Kuczynski AI Assistant")
     print("="*60)
-    print(f"  Loaded {len(searcher.positions)} philosophical positions")
+    print("  Warming up search index in background (see /readyz)")
     print(f"  Server starting on http://0.0.0.0:{port}")
     print("="*60 + "\n")
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,4 @@
+"""
+Offline benchmark suite
+Run with `python -m benchmarks.run --help`
+"""
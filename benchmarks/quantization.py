@@ -0,0 +1,104 @@
+"""
+Quantized embedding benchmark
+Reports memory saved and recall@k lost for SemanticSearch's float16/int8 modes,
+with and without exact rescoring from the full-precision matrix
+
+Usage:
+    python -m benchmarks.quantization --positions 100000 --dim 1536 --k 7
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from benchmarks import stubs, synthetic
+from search import RESCORE_FACTOR, RESCORE_MIN, SemanticSearch, compact_scores, normalize_rows, quantize
+
+
+def top_k(scores, k):
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+def recall(expected, found):
+    return len(set(expected.tolist()) & set(found.tolist())) / len(expected)
+
+
+def compact_searcher(exact, mode):
+    """SemanticSearch over an in-memory matrix, so rescoring runs the production _search_compact"""
+    searcher = SemanticSearch.__new__(SemanticSearch)
+    searcher.embedding_mode = mode
+    searcher.embeddings = exact
+    searcher.compact, searcher.compact_scale = quantize(exact, mode)
+    return searcher
+
+
+def run(args):
+    print(f"Generating {args.positions} x {args.dim} clustered embeddings...")
+    centers = synthetic.centroids(args.dim)
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((args.positions, args.dim), dtype=np.float32) / np.sqrt(args.dim)
+    matrix += centers[np.arange(args.positions) % len(centers)]
+    exact = normalize_rows(matrix)
+    del matrix
+
+    queries = [stubs.fake_embedding(q, args.dim, centers)
+               for q in synthetic.make_queries(args.queries, synthetic.vocabulary())]
+    truth = [top_k(exact @ q, args.k) for q in queries]
+    n_candidates = max(RESCORE_MIN, args.k * RESCORE_FACTOR)
+
+    float64_bytes = args.positions * args.dim * 8
+    results = {'float64': {'memory_mb': float64_bytes / 1e6, 'saved_vs_float64': 0.0,
+                           'recall_at_k': 1.0, 'recall_at_k_rescored': 1.0}}
+    for mode in ('float16', 'int8'):
+        searcher = compact_searcher(exact, mode)
+        compact, scale = searcher.compact, searcher.compact_scale
+        memory = compact.nbytes + (scale.nbytes if scale is not None else 0)
+
+        raw_recalls, rescored_recalls, latencies = [], [], []
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rescored, _ = searcher._search_compact(q, args.k, min_similarity=-1.0)
+            latencies.append(time.perf_counter() - start)
+            raw_recalls.append(recall(expected, top_k(compact_scores(compact, scale, q), args.k)))
+            rescored_recalls.append(recall(expected, np.array(rescored)))
+
+        results[mode] = {
+            'memory_mb': memory / 1e6,
+            'saved_vs_float64': 1 - memory / float64_bytes,
+            'recall_at_k': float(np.mean(raw_recalls)),
+            'recall_at_k_rescored': float(np.mean(rescored_recalls)),
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000
+        }
+        del searcher, compact, scale
+
+    print(f"\nrecall@{args.k} over {args.queries} queries, {n_candidates} candidates rescored")
+    print(f"{'mode':<10} {'memory MB':>10} {'saved':>8} {'recall':>8} {'rescored':>10}")
+    print("-" * 50)
+    for mode, r in results.items():
+        print(f"{mode:<10} {r['memory_mb']:>10.1f} {r['saved_vs_float64']:>8.1%} "
+              f"{r['recall_at_k']:>8.3f} {r['recall_at_k_rescored']:>10.3f}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Memory vs recall@k for quantized embeddings')
+    parser.add_argument('--positions', type=int, default=100_000)
+    parser.add_argument('--dim', type=int, default=stubs.EMBEDDING_DIM)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=7)
+    parser.add_argument('--output', help='write results JSON here')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'positions': args.positions, 'dim': args.dim, 'k': args.k, 'results': results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
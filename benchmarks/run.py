@@ -0,0 +1,250 @@
+"""
+Offline load test and microbenchmarks
+Stubs the embeddings and chat providers, generates a synthetic corpus and reports
+p50/p99 latency, requests/second and peak memory per component and endpoint
+
+Usage:
+    python -m benchmarks.run                          # 100k positions, 50k rules
+    python -m benchmarks.run --quick                  # 10k positions, 5k rules
+    python -m benchmarks.run --quick --only endpoints --concurrency 32 --embed-latency-ms 50
+    python -m benchmarks.run --output bench_results.json --baseline baseline.json
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks import stubs, synthetic
+
+BENCH_KEY = 'benchmark-key'
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values), q)) if values else 0.0
+
+
+def measure(fn, inputs, iterations, warmup=3, memory_iterations=5, concurrency=1):
+    """
+    Time fn over inputs (cycled), then re-run a few calls under tracemalloc
+
+    With concurrency > 1 the calls are issued from that many threads at once:
+    rps is then aggregate throughput and latencies include time spent queued.
+    fn may return an HTTP status; 503s (shed load) are counted separately and
+    left out of the latency percentiles. Latency and memory are measured in
+    separate passes so tracemalloc overhead does not inflate the timings.
+    """
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+
+    def timed(i):
+        start = time.perf_counter()
+        status = fn(inputs[i % len(inputs)])
+        return time.perf_counter() - start, status
+
+    wall_start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            calls = list(pool.map(timed, range(iterations)))
+    else:
+        calls = [timed(i) for i in range(iterations)]
+    wall = time.perf_counter() - wall_start
+    shed = sum(1 for _, status in calls if status == 503)
+    latencies = [latency for latency, status in calls if status != 503]
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(memory_iterations):
+        fn(inputs[i % len(inputs)])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': float(np.mean(latencies)) * 1000 if latencies else 0.0,
+        'rps': iterations / wall if wall else 0.0,
+        'ok_rps': (iterations - shed) / wall if wall else 0.0,
+        'shed_rate': shed / iterations if iterations else 0.0,
+        'peak_mem_mb': max(0, peak - baseline) / (1024 * 1024)
+    }
+
+
+def build_components(args, workdir):
+    """Synthetic corpus -> SemanticSearch and KuczynskiEngine wired to stub clients"""
+    import search
+    from kuczynski_engine import KuczynskiEngine
+
+    print(f"Generating synthetic corpus: {args.positions} positions, {args.rules} rules, dim {args.dim}...")
+    database_path, embeddings_path, rules_path, vocab, centroids = synthetic.write_corpus(
+        workdir, args.positions, args.rules, args.dim)
+
+    search.OpenAI = functools.partial(stubs.StubOpenAI, dim=args.dim, centroids=centroids,
+                                      latency=args.embed_latency_ms / 1000)
+    searcher = search.SemanticSearch(database_path, embeddings_path)
+    kire = KuczynskiEngine(rules_path)
+    return searcher, kire, vocab
+
+
+def bench_components(args, searcher, kire, queries):
+    results = {}
+    print("Benchmarking KuczynskiEngine.deduce...")
+    results['kire.deduce'] = measure(lambda q: kire.deduce(q, max_rules=18), queries, args.iterations)
+    print("Benchmarking SemanticSearch.search...")
+    results['search.search'] = measure(lambda q: searcher.search(q, top_k=7), queries, args.iterations)
+    return results
+
+
+def bench_endpoints(args, searcher, kire, queries):
+    import app as app_module
+
+    app_module.searcher = searcher
+    app_module.kire = kire
+    app_module.warmup_status.update({'searcher': 'ready', 'kire': 'ready'})
+    app_module.grok_client = stubs.StubOpenAI(
+        tokens=args.tokens, first_token_latency=args.ttft_ms / 1000)
+    os.environ['ZHI_PRIVATE_KEY'] = BENCH_KEY
+    # One test client per thread: clients keep a cookie jar and are not shared safely
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app_module.app.test_client()
+        return local.client
+
+    def ask(question):
+        response = client().post('/api/ask', json={'question': question, 'provider': 'grok', 'mode': 'enhanced', 'follow_up': False})
+        # Drain the SSE stream so the full generator runs
+        for _ in response.response:
+            pass
+        response.close()
+        assert response.status_code in (200, 503), response.status_code
+        return response.status_code
+
+    def knowledge(query):
+        response = client().post('/api/internal/knowledge', json={'query': query},
+                                 headers={'Authorization': f"Bearer {BENCH_KEY}"})
+        assert response.status_code in (200, 503), response.status_code
+        return response.status_code
+
+    results = {}
+    suffix = f" x{args.concurrency}" if args.concurrency > 1 else ''
+    for name, fn in (('POST /api/ask', ask), ('POST /api/internal/knowledge', knowledge)):
+        print(f"Benchmarking {name}{suffix}...")
+        calls_before = searcher.client.embedding_calls
+        result = measure(fn, queries, args.iterations, concurrency=args.concurrency)
+        # Fewer embedding calls than requests means single-flight coalesced identical queries
+        result['embedding_calls'] = searcher.client.embedding_calls - calls_before
+        results[name + suffix] = result
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages (latency/memory up or rps down beyond tolerance)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for key in ('p50_ms', 'p99_ms', 'peak_mem_mb'):
+            if previous.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {previous[key]:.2f} -> {current[key]:.2f}")
+        if previous.get('rps') and current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']:.1f} -> {current['rps']:.1f}")
+    return regressions
+
+
+def print_table(results):
+    print(f"\n{'benchmark':<36} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>10} {'503 %':>7} {'peak MB':>10}")
+    print("-" * 88)
+    for name, r in results.items():
+        print(f"{name:<36} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['rps']:>10.1f} "
+              f"{r.get('shed_rate', 0.0):>7.1%} {r['peak_mem_mb']:>10.2f}")
+    print()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline ASKJM benchmarks with stubbed providers')
+    parser.add_argument('--positions', type=int, help='default 100000 (10000 with --quick)')
+    parser.add_argument('--rules', type=int, help='default 50000 (5000 with --quick)')
+    parser.add_argument('--dim', type=int, default=stubs.EMBEDDING_DIM)
+    parser.add_argument('--queries', type=int, default=50, help='distinct synthetic queries (cycled)')
+    parser.add_argument('--iterations', type=int, help='default 200 (50 with --quick)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='drive the endpoints from this many threads (load test; reports 503 rate)')
+    parser.add_argument('--tokens', type=int, default=200, help='tokens per stubbed chat stream')
+    parser.add_argument('--embed-latency-ms', type=float, default=0.0, help='simulated embeddings round trip')
+    parser.add_argument('--ttft-ms', type=float, default=0.0, help='simulated provider time to first token')
+    parser.add_argument('--only', choices=['components', 'endpoints'], help='run one group')
+    parser.add_argument('--quick', action='store_true', help='smaller defaults; explicit sizes still win')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='previous results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args(argv)
+    defaults = {'positions': 10_000, 'rules': 5_000, 'iterations': 50} if args.quick else \
+        {'positions': 100_000, 'rules': 50_000, 'iterations': 200}
+    for name, value in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='askjm-bench-') as workdir:
+        searcher, kire, vocab = build_components(args, workdir)
+        queries = synthetic.make_queries(args.queries, vocab)
+
+        results = {}
+        if args.only in (None, 'components'):
+            results.update(bench_components(args, searcher, kire, queries))
+        if args.only in (None, 'endpoints'):
+            results.update(bench_endpoints(args, searcher, kire, queries))
+
+    print_table(results)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'positions': args.positions,
+            'rules': args.rules,
+            'dim': args.dim,
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'tokens': args.tokens
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"✗ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"✓ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Local stand-ins for the OpenAI and Anthropic clients
+Same call shapes as the SDK methods the app uses, with no network access
+"""
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM, centroids=None, noise: float = 1.0) -> np.ndarray:
+    """
+    Deterministic unit vector derived from the text
+
+    With centroids, the vector is a noisy copy of one centroid so queries land
+    near a cluster of the synthetic corpus (see synthetic.write_corpus).
+    """
+    seed = zlib.crc32(text.encode('utf-8'))
+    rng = np.random.default_rng(seed)
+    if centroids is None:
+        vec = rng.standard_normal(dim, dtype=np.float32)
+    else:
+        dim = centroids.shape[1]
+        vec = centroids[seed % len(centroids)] + rng.standard_normal(dim, dtype=np.float32) * (noise / np.sqrt(dim))
+    return vec / np.linalg.norm(vec)
+
+
+class _Embeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, input):
+        self.owner.embedding_calls += 1
+        if self.owner.latency:
+            time.sleep(self.owner.latency)
+        texts = [input] if isinstance(input, str) else list(input)
+        data = [SimpleNamespace(embedding=fake_embedding(t, self.owner.dim, self.owner.centroids).tolist()) for t in texts]
+        return SimpleNamespace(data=data)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, stream=False, max_tokens=None):
+        self.owner.chat_calls += 1
+        return self.owner._stream()
+
+
+class StubOpenAI:
+    """OpenAI-compatible client: embeddings.create and streaming chat.completions.create"""
+
+    def __init__(self, api_key=None, base_url=None, dim=EMBEDDING_DIM, centroids=None, latency=0.0,
+                 tokens=200, token_text='word ', first_token_latency=0.0):
+        self.dim = dim
+        self.centroids = centroids
+        self.latency = latency
+        self.tokens = tokens
+        self.token_text = token_text
+        self.first_token_latency = first_token_latency
+        self.embedding_calls = 0
+        self.chat_calls = 0
+        self.embeddings = _Embeddings(self)
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def _stream(self):
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        for _ in range(self.tokens):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.token_text))])
+
+
+class _MessageStream:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        if self.owner.first_token_latency:
+            time.sleep(self.owner.first_token_latency)
+        for _ in range(self.owner.tokens):
+            yield self.owner.token_text
+
+
+class StubAnthropic:
+    """Anthropic-compatible client: messages.stream as a context manager"""
+
+    def __init__(self, api_key=None, tokens=200, token_text='word ', first_token_latency=0.0):
+        self.tokens = tokens
+        self.token_text = token_text
+        self.first_token_latency = first_token_latency
+        self.messages = SimpleNamespace(stream=lambda **kwargs: _MessageStream(self))
@@ -0,0 +1,97 @@
+"""
+Synthetic corpora for benchmarks
+Positions use the v32 array format; rules use the kuczynski_rules_full.json format
+"""
+import json
+import os
+import pickle
+
+import numpy as np
+
+DOMAINS = ['epistemology', 'metaphysics', 'logic', 'philosophy of mind', 'ethics',
+           'philosophy of language', 'economics', 'psychology', 'history', 'meta']
+
+
+def vocabulary(size: int = 5000, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters, rng.integers(4, 10))))
+    return sorted(words)
+
+
+def make_positions(n: int, vocab: list, seed: int = 1) -> list:
+    rng = np.random.default_rng(seed)
+    positions = []
+    for i in range(n):
+        words = rng.choice(vocab, 40)
+        positions.append({
+            'position_id': f"SYN-{i:06d}",
+            'title': ' '.join(words[:5]).title(),
+            'thesis': ' '.join(words),
+            'domain': DOMAINS[i % len(DOMAINS)],
+            'source': [f"WORK-{i % 250:03d}"]
+        })
+    return positions
+
+
+def make_rules(n: int, vocab: list, seed: int = 2) -> list:
+    rng = np.random.default_rng(seed)
+    rules = []
+    for i in range(n):
+        premise_words = rng.choice(vocab, 3)
+        rules.append({
+            'id': f"SYN-KIRE-{i:05d}",
+            'year': 2025,
+            'premise': '|'.join(premise_words),
+            'conclusion': ' '.join(rng.choice(vocab, 12)),
+            'strength': round(float(rng.uniform(0.5, 1.0)), 2),
+            'domain': DOMAINS[i % len(DOMAINS)]
+        })
+    return rules
+
+
+def centroids(dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1000)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    return centers / np.linalg.norm(centers, axis=1, keepdims=True)
+
+
+def make_queries(n: int, vocab: list, seed: int = 3) -> list:
+    rng = np.random.default_rng(seed)
+    return [' '.join(rng.choice(vocab, 12)) for _ in range(n)]
+
+
+def write_corpus(directory: str, n_positions: int, n_rules: int, dim: int, seed: int = 0):
+    """
+    Write a database JSON, an embeddings pickle and a rules JSON into directory
+
+    Returns:
+        (database_path, embeddings_path, rules_path, vocab, centroids)
+    """
+    os.makedirs(directory, exist_ok=True)
+    vocab = vocabulary(seed=seed)
+
+    database_path = os.path.join(directory, 'synthetic_database.json')
+    with open(database_path, 'w', encoding='utf-8') as f:
+        json.dump({'database_metadata': {'version': 'synthetic'}, 'positions': make_positions(n_positions, vocab)}, f)
+
+    # Noisy copies of cluster centroids, in the same layout SemanticSearch pickles;
+    # stub query embeddings land on the same centroids (cosine ~0.5 within a cluster)
+    centers = centroids(dim, seed=seed)
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n_positions, dim), dtype=np.float32)
+    embeddings *= 1.0 / np.sqrt(dim)
+    embeddings += centers[np.arange(n_positions) % len(centers)]
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings_path = os.path.join(directory, 'synthetic_embeddings.pkl')
+    with open(embeddings_path, 'wb') as f:
+        pickle.dump(embeddings, f)
+    del embeddings
+
+    rules_path = os.path.join(directory, 'synthetic_rules.json')
+    with open(rules_path, 'w', encoding='utf-8') as f:
+        json.dump(make_rules(n_rules, vocab), f)
+
+    return database_path, embeddings_path, rules_path, vocab, centers
@@ -0,0 +1,240 @@
+"""
+Conversation-aware retrieval for follow-up questions
+Keeps each session's last query embedding, candidate pool and fired KIRE rules so
+a follow-up reuses or incrementally updates them instead of starting from scratch
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# Set to 0 to run every question as a fresh search (per request: "follow_up": false)
+FOLLOW_UP = os.environ.get('RETRIEVAL_FOLLOW_UP', '1') != '0'
+# Contexts idle longer than this are dropped
+CONTEXT_TTL = float(os.environ.get('RETRIEVAL_CONTEXT_TTL', 1800))
+# Least recently used contexts are evicted beyond this many sessions
+MAX_CONTEXTS = int(os.environ.get('RETRIEVAL_CONTEXT_MAX', 1000))
+# Weight of the new question when blending with the previous turn's embedding
+BLEND_WEIGHT = float(os.environ.get('RETRIEVAL_BLEND_WEIGHT', 0.6))
+# A blend is abandoned for a full search when no candidate is within this margin of
+# the previous turn's best similarity, scored against the new question alone
+BLEND_MARGIN = float(os.environ.get('RETRIEVAL_BLEND_MARGIN', 0.15))
+# Positions kept from each turn as the next turn's candidate neighbourhood
+POOL_SIZE = 100
+# Graph neighbours added per previous hit when rescoring a follow-up
+NEIGHBORS_PER_HIT = 10
+# Longer questions are treated as new topics
+MAX_FOLLOW_UP_WORDS = 15
+
+# "More of the same" requests: answered from the previous turn without any new search.
+# Anchored at the end, so any new content ("more examples of Kant's ethics") is a new question.
+_REUSE = re.compile(
+    r"^\s*(?:ok(?:ay)?,?\s*|and\s+|now\s+|please\s+|can you\s+|could you\s+)*"
+    r"(?:"
+    r"(?:give|show|provide|offer|tell)?\s*(?:me\s+|us\s+)?"
+    r"(?:another|more|one more|a further|a different|other|further)\s+"
+    r"(?:concrete\s+)?(?:examples?|illustrations?|instances?|cases?)"
+    r"(?:\s+(?:of|for)\s+(?:that|this|it|them|those|these))?"
+    r"|go on|continue|elaborate|say more|tell me more|keep going|expand on (?:that|this|it)|"
+    r"explain (?:that|this|it)(?: further| more| again)?|why(?: is that| so)?|how so|in what sense|for example"
+    r")(?:,?\s*please)?\s*[.?!]*\s*$",
+    re.IGNORECASE
+)
+
+# Short questions that lean on the previous turn: new content, blended with the old query.
+# Bare "it"/"this"/"that"/"he"/"his" are left out: they occur in most self-contained
+# questions ("what is it like to be a bat?", "do you think that...", "what is his view of...").
+_ANAPHORA = re.compile(
+    r"^\s*(?:and|but|so|also|what about|how about|then)\b"
+    r"|\b(?:these|those|they|them|its|their|above|previous|earlier|same)\b"
+    r"|\b(?:this|that)\s+(?:point|argument|claim|idea|view|position|example|answer|distinction|thesis|objection)\b",
+    re.IGNORECASE
+)
+
+
+class RetrievalContext:
+    """What one turn retrieved; the input to the next turn's retrieval"""
+
+    __slots__ = ('question', 'query_embedding', 'pool', 'positions', 'kire_deductions', 'turns',
+                 'top_similarity', 'updated')
+
+    def __init__(self, question, query_embedding, pool, positions, kire_deductions, turns=1, top_similarity=0.0):
+        self.question = question
+        self.query_embedding = query_embedding
+        self.pool = pool
+        self.positions = positions
+        self.kire_deductions = kire_deductions
+        self.turns = turns
+        # Best similarity between this turn's question and its candidates; the drift reference
+        self.top_similarity = top_similarity
+        self.updated = time.monotonic()
+
+
+class ContextCache:
+    """Thread-safe LRU of RetrievalContexts with an idle TTL"""
+
+    def __init__(self, max_entries=MAX_CONTEXTS, ttl=CONTEXT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if not key:
+            return None
+        with self._lock:
+            context = self._entries.get(key)
+            if context is None:
+                return None
+            if time.monotonic() - context.updated > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return context
+
+    def put(self, key, context):
+        if not key:
+            return
+        now = time.monotonic()
+        context.updated = now
+        with self._lock:
+            self._entries[key] = context
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            # Oldest entries are at the front, so expired ones can be dropped from there
+            while self._entries:
+                oldest_key, oldest = next(iter(self._entries.items()))
+                if now - oldest.updated <= self.ttl:
+                    break
+                del self._entries[oldest_key]
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def session_key(session):
+    """Per-browser-session key, created on first use (works with or without /api/login)"""
+    key = session.get('retrieval_id')
+    if not key:
+        key = session['retrieval_id'] = uuid.uuid4().hex
+    return key
+
+
+def classify(question, context):
+    """'reuse', 'blend' or 'fresh' for a question given the previous turn's context"""
+    if context is None:
+        return 'fresh'
+    if _REUSE.search(question):
+        return 'reuse'
+    if len(question.split()) <= MAX_FOLLOW_UP_WORDS and _ANAPHORA.search(question):
+        return 'blend'
+    return 'fresh'
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _deduce(kire, question, timer, max_rules, domains=None):
+    if not kire:
+        return []
+    try:
+        print("Running KIRE inference engine...")
+        with timer.stage('kire_deduce'):
+            deductions = kire.deduce(question, max_rules=max_rules, domains=domains)
+        print(f"KIRE fired {len(deductions)} inference rules")
+        return deductions
+    except Exception as e:
+        print(f"KIRE inference failed: {e}")
+        return []
+
+
+def _merge_rules(new_rules, previous_rules, max_rules):
+    merged = {rule['id']: rule for rule in previous_rules}
+    merged.update((rule['id'], rule) for rule in new_rules)
+    return sorted(merged.values(), key=lambda r: -r['strength'])[:max_rules]
+
+
+def retrieve(searcher, kire, question, context, timer, top_k=7, max_rules=18, follow_up=True):
+    """
+    Positions and KIRE deductions for a question, using the previous turn when it applies
+
+    - reuse: "another example", "elaborate"... -> previous positions and rules, no network calls
+    - blend: short anaphoric follow-up -> new embedding blended with the previous one,
+      rescored over the previous candidate pool and its graph neighbours only, and KIRE
+      run only over the rule domains already in play; falls back to fresh when no
+      candidate is close enough to the new question on its own
+    - fresh: full search and full KIRE run
+
+    Returns:
+        (positions, kire_deductions, new_context, strategy)
+    """
+    strategy = classify(question, context) if follow_up and FOLLOW_UP else 'fresh'
+
+    if strategy == 'reuse':
+        print(f"Follow-up reuses previous retrieval (turn {context.turns + 1})")
+        new_context = RetrievalContext(question, context.query_embedding, context.pool, context.positions,
+                                       context.kire_deductions, context.turns + 1, context.top_similarity)
+        return context.positions, context.kire_deductions, new_context, strategy
+
+    with metrics.stage('query_embedding'):
+        query_embedding = _unit(searcher.embed_query(question))
+
+    pool = None
+    if strategy == 'blend':
+        print(f"Follow-up blends with previous retrieval (turn {context.turns + 1})")
+        candidates = set(context.pool)
+        if searcher.graph is not None:
+            for position in context.positions:
+                index = searcher.index_by_id.get(position['position_id'])
+                if index is not None:
+                    candidates.update(i for i, _ in searcher.graph.neighbors(index, NEIGHBORS_PER_HIT))
+        # Drift check on the neighbourhood alone: the new question must find something in it
+        # nearly as close as the previous question did, otherwise it is a new topic
+        top_similarity = float(np.max(searcher._cosine(query_embedding, sorted(candidates)))) if candidates else 0.0
+        if top_similarity >= context.top_similarity - BLEND_MARGIN:
+            blended = _unit(BLEND_WEIGHT * query_embedding + (1 - BLEND_WEIGHT) * context.query_embedding)
+            pool = searcher.search_embedding(blended, top_k=POOL_SIZE, candidates=candidates)
+        if pool is None or len(pool) < top_k:
+            # Classified as a follow-up, but the old neighbourhood does not answer it
+            print("Blended retrieval falls short of the previous turn, treating as a new question")
+            strategy = 'fresh'
+        else:
+            query_embedding = blended
+
+    if strategy == 'blend':
+        domains = {rule.get('domain') for rule in context.kire_deductions}
+        domains.update(p.get('domain') for p in pool[:top_k])
+        new_rules = _deduce(kire, question, timer, max_rules, domains=domains)
+        deductions = _merge_rules(new_rules, context.kire_deductions, max_rules)
+        turns = context.turns + 1
+    else:
+        pool = searcher.search_embedding(query_embedding, top_k=POOL_SIZE)
+        top_similarity = pool[0]['similarity'] if pool else 0.0
+        deductions = _deduce(kire, question, timer, max_rules)
+        turns = 1
+
+    positions = pool[:top_k]
+    new_context = RetrievalContext(
+        question,
+        query_embedding,
+        [searcher.index_by_id[p['position_id']] for p in pool],
+        positions,
+        deductions,
+        turns,
+        top_similarity
+    )
+    return positions, deductions, new_context, strategy
@@ -0,0 +1,210 @@
+"""
+Bounded text extraction for uploaded documents
+Streams pages/paragraphs and stops as soon as the character budget is reached
+"""
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Iterator, Optional
+
+try:
+    import PyPDF2  # type: ignore
+except ImportError:
+    PyPDF2 = None
+
+try:
+    import docx  # type: ignore
+except ImportError:
+    docx = None
+
+# Characters returned to the client (matches the old text[:10000] truncation)
+MAX_CHARS = int(os.environ.get('UPLOAD_MAX_CHARS', 10000))
+# Uploads larger than this are rejected before any parsing happens
+MAX_UPLOAD_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+# PDFs with at least this many pages are extracted in a process pool (0 disables the pool)
+PDF_POOL_MIN_PAGES = int(os.environ.get('UPLOAD_PDF_POOL_MIN_PAGES', 0))
+PDF_POOL_WORKERS = int(os.environ.get('UPLOAD_PDF_POOL_WORKERS', 2))
+PDF_POOL_BATCH_PAGES = int(os.environ.get('UPLOAD_PDF_POOL_BATCH_PAGES', 4))
+PDF_POOL_TIMEOUT = float(os.environ.get('UPLOAD_PDF_POOL_TIMEOUT', 20))
+# Uploads extracted in a pool at the same time; further large PDFs are read in-process
+PDF_POOL_MAX_UPLOADS = int(os.environ.get('UPLOAD_PDF_POOL_MAX_UPLOADS', 2))
+
+SEPARATOR = '\n\n'
+
+_pdf_pool_slots = threading.BoundedSemaphore(max(1, PDF_POOL_MAX_UPLOADS))
+# Per-worker-process cache of the reader for the PDF currently being extracted
+_worker_reader = None
+
+
+class ExtractionError(Exception):
+    """Raised when an upload cannot be turned into text"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def file_size(stream) -> int:
+    """Size of a seekable upload stream without reading it"""
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(pos)
+    return size
+
+
+def take(chunks: Iterator[str], max_chars: int = MAX_CHARS) -> str:
+    """Join non-empty chunks with blank lines, stopping once max_chars is reached"""
+    parts = []
+    total = 0
+    for chunk in chunks:
+        if not chunk or not chunk.strip():
+            continue
+        if parts:
+            total += len(SEPARATOR)
+        parts.append(chunk)
+        total += len(chunk)
+        if total >= max_chars:
+            break
+    return SEPARATOR.join(parts)[:max_chars]
+
+
+def iter_txt(stream, max_chars: int = MAX_CHARS) -> Iterator[str]:
+    """Yield decoded text, reading at most enough bytes to fill the budget"""
+    # UTF-8 uses at most 4 bytes per character
+    yield stream.read(max_chars * 4).decode('utf-8', errors='ignore')
+
+
+def iter_pdf_pages(reader) -> Iterator[str]:
+    """Yield the text of each page, extracting every page exactly once"""
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def iter_docx_paragraphs(document) -> Iterator[str]:
+    for para in document.paragraphs:
+        yield para.text
+
+
+def _extract_pdf_range(path: str, start: int, stop: int) -> list:
+    """Process-pool worker: extract pages [start, stop) from a spooled PDF, parsing it once per worker"""
+    global _worker_reader
+    if _worker_reader is None or _worker_reader[0] != path:
+        _worker_reader = (path, PyPDF2.PdfReader(path))
+    reader = _worker_reader[1]
+    page_count = len(reader.pages)
+    pages = [reader.pages[i].extract_text() or '' for i in range(start, min(stop, page_count))]
+    if stop >= page_count:
+        # Last batch of this document: release the parsed file
+        _worker_reader = None
+    return pages
+
+
+def _terminate_pool(pool):
+    """Shut down a pool, killing workers that are still busy (e.g. stuck on a bad PDF)"""
+    # cancel_futures drops queued batches; running workers must be terminated explicitly
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    return len(processes)
+
+
+def iter_pdf_pages_pooled(path: str, page_count: int) -> Iterator[str]:
+    """
+    Yield page text extracted in a process pool, one batch in flight per worker
+
+    Each upload gets its own short-lived pool, so a timeout can kill its workers
+    without breaking other uploads. Workers receive the spooled file's path, not
+    its bytes. Batches are submitted lazily so a consumer that stops early
+    (budget reached) never pays for the rest of the document.
+    """
+    pool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS)
+    batch = max(1, PDF_POOL_BATCH_PAGES)
+    starts = iter(range(0, page_count, batch))
+    pending = []
+    try:
+        for _ in range(max(1, PDF_POOL_WORKERS)):
+            start = next(starts, None)
+            if start is None:
+                break
+            pending.append(pool.submit(_extract_pdf_range, path, start, start + batch))
+
+        while pending:
+            future = pending.pop(0)
+            try:
+                pages = future.result(timeout=PDF_POOL_TIMEOUT)
+            except FutureTimeoutError:
+                print(f"✗ PDF extraction timed out, terminated {_terminate_pool(pool)} workers")
+                raise ExtractionError('Timed out reading PDF', status=408)
+            start = next(starts, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_pdf_range, path, start, start + batch))
+            yield from pages
+    finally:
+        _terminate_pool(pool)
+
+
+def _spool(stream) -> str:
+    """Copy an upload stream to a temporary file in fixed-size chunks; returns its path"""
+    with tempfile.NamedTemporaryFile(prefix='upload-', suffix='.pdf', delete=False) as spooled:
+        shutil.copyfileobj(stream, spooled)
+    return spooled.name
+
+
+def extract_text(file, filename: str, max_chars: int = MAX_CHARS, max_bytes: Optional[int] = MAX_UPLOAD_BYTES) -> str:
+    """
+    Extract at most max_chars characters of text from an uploaded file
+
+    Args:
+        file: Seekable binary stream (werkzeug FileStorage or file object)
+        filename: Original filename, used to pick the parser
+        max_chars: Character budget; extraction stops once it is reached
+        max_bytes: Reject uploads larger than this before parsing (None disables)
+
+    Raises:
+        ExtractionError with an HTTP status for the caller to return
+    """
+    stream = getattr(file, 'stream', file)
+    if max_bytes is not None and file_size(stream) > max_bytes:
+        raise ExtractionError(f'File too large (max {max_bytes // (1024 * 1024)} MB)', status=413)
+
+    name = filename.lower()
+    if name.endswith('.txt'):
+        return take(iter_txt(stream, max_chars), max_chars)
+
+    if name.endswith('.pdf'):
+        if not PyPDF2:
+            raise ExtractionError('PDF support not available')
+        try:
+            if PDF_POOL_MIN_PAGES:
+                path = _spool(stream)
+                try:
+                    reader = PyPDF2.PdfReader(path)
+                    if len(reader.pages) >= PDF_POOL_MIN_PAGES and _pdf_pool_slots.acquire(blocking=False):
+                        pages = iter_pdf_pages_pooled(path, len(reader.pages))
+                        try:
+                            return take(pages, max_chars)
+                        finally:
+                            pages.close()
+                            _pdf_pool_slots.release()
+                    return take(iter_pdf_pages(reader), max_chars)
+                finally:
+                    os.unlink(path)
+            return take(iter_pdf_pages(PyPDF2.PdfReader(stream)), max_chars)
+        except ExtractionError:
+            raise
+        except Exception as e:
+            raise ExtractionError(f'Error reading PDF: {str(e)}')
+
+    if name.endswith(('.doc', '.docx')):
+        if not docx:
+            raise ExtractionError('Word document support not available')
+        try:
+            return take(iter_docx_paragraphs(docx.Document(stream)), max_chars)
+        except Exception as e:
+            raise ExtractionError(f'Error reading Word document: {str(e)}')
+
+    raise ExtractionError('Unsupported file type. Please upload .txt, .pdf, or .docx')
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for `gunicorn -c gunicorn.conf.py 'app:create_app()'`
+
+Set GUNICORN_PRELOAD=1 to build the search index once in the master before
+forking; workers then share the read-only embeddings copy-on-write.
+
+With preload the master imports the app (openai/anthropic, hence ssl, and the
+threading locks in admission/metrics/conversation) before forking, so gevent
+has to patch the stdlib here, before that import; patching later in the worker
+is what breaks HTTPS clients (RecursionError in ssl). Set
+GUNICORN_WORKER_CLASS=gthread (or sync) to preload without gevent.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '') == '1'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+
+if preload_app and worker_class == 'gevent':
+    from gevent import monkey  # type: ignore
+    monkey.patch_all()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+timeout = 120
+
+if preload_app:
+    # create_app() reads this: build the index synchronously in the master
+    os.environ.setdefault('APP_WARMUP', 'sync')
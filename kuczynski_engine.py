@@ -4,7 +4,7 @@ Converts user input into chain of savage Kuczynski deductions
 """
 import json
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 
 class KuczynskiEngine:
     def __init__(self, rules_path='kuczynski_rules_full.json'):
@@ -13,13 +13,14 @@ class KuczynskiEngine:
             self.rules = json.load(f)
         print(f"✓ KIRE loaded with {len(self.rules)} inference rules")
     
-    def deduce(self, phenomenon: str, max_rules: int = 18) -> List[Dict]:
+    def deduce(self, phenomenon: str, max_rules: int = 18, domains: Optional[Set[str]] = None) -> List[Dict]:
         """
         Execute Kuczynski inference engine on phenomenon
         
         Args:
             phenomenon: User's input text
             max_rules: Maximum number of rules to fire (default 18)
+            domains: Only evaluate rules from these domains (default: all rules)
         
         Returns:
             List of fired rules sorted by strength (most savage first)
@@ -29,6 +30,8 @@ class KuczynskiEngine:
         conclusions_text = ""  # Accumulate conclusions for chaining
         
         for rule in self.rules:
+            if domains is not None and rule.get("domain") not in domains:
+                continue
             # Search in original phenomenon + accumulated conclusions (chaining)
             search_space = text + " " + conclusions_text
             
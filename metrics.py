@@ -0,0 +1,136 @@
+"""
+Per-stage latency instrumentation
+Histograms exposed in Prometheus text format on /metrics, plus a per-request
+timer that renders a Server-Timing header
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from flask import g, has_request_context  # type: ignore
+except ImportError:
+    g = None
+
+    def has_request_context():
+        return False
+
+# Seconds; covers sub-millisecond rule matching up to multi-minute LLM streams
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LABELS = ('stage', 'provider', 'model', 'mode')
+
+
+class Histogram:
+    """Minimal thread-safe labelled histogram (Prometheus cumulative buckets)"""
+
+    def __init__(self, name: str, help_text: str, labelnames=LABELS, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in sorted(items):
+            label_str = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key))
+            sep = ',' if label_str else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_str}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_str}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{label_str}}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{label_str}}} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('askjm_stage_seconds', 'Latency of request stages in seconds')
+
+REGISTRY = [STAGE_SECONDS]
+
+
+class RequestTimer:
+    """
+    Collects stage timings for one request
+
+    Every observation goes to STAGE_SECONDS with this request's provider/model/mode
+    labels and is kept locally for the Server-Timing header. The timer is a plain
+    object so SSE generators can keep using it after the request context is gone.
+    """
+
+    def __init__(self, provider: str = '', model: str = '', mode: str = ''):
+        self.labels = {'provider': provider, 'model': model, 'mode': mode}
+        self.timings: List[Tuple[str, float]] = []
+
+    def observe(self, stage: str, seconds: float):
+        STAGE_SECONDS.observe(seconds, stage=stage, **self.labels)
+        self.timings.append((stage, seconds))
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def server_timing(self) -> str:
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.timings)
+
+
+def start_request(provider: str = '', model: str = '', mode: str = '') -> RequestTimer:
+    """Create a RequestTimer and attach it to flask.g for stage() and the Server-Timing hook"""
+    timer = RequestTimer(provider, model, mode)
+    if has_request_context():
+        g.request_timer = timer
+    return timer
+
+
+def current_timer() -> Optional[RequestTimer]:
+    if has_request_context():
+        return getattr(g, 'request_timer', None)
+    return None
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage against the current request's timer (or unlabelled outside a request)"""
+    timer = current_timer()
+    if timer is not None:
+        with timer.stage(name):
+            yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    return ''.join(metric.render() for metric in REGISTRY)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
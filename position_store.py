@@ -0,0 +1,413 @@
+"""
+Indexed position store
+Embedded SQLite copy of a position database (any data/ version) with indexes on
+position id, domain and source work, so citations resolve without loading JSON.
+Also holds the KIRE rules, and tracks a content hash and sync version per record
+(plus tombstones for removed records) so mirrors can pull only what changed.
+
+Build:
+    python position_store.py [database.json] [--rules kuczynski_rules_full.json] [--output data/positions.sqlite3]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+from positions import parse_positions
+
+DEFAULT_PATH = 'data/positions.sqlite3'
+SCHEMA_VERSION = '3'
+# SQLite's default limit on bound parameters is 999
+MAX_PARAMS = 500
+
+# Leading identifier of a source string: "WORK-001 (Chapters 10-13)" -> "WORK-001",
+# "KUC-2003-ANAL: Paradox of Analysis" -> "KUC-2003-ANAL"
+_WORK_ID = re.compile(r'^([A-Z][A-Z0-9]*(?:-[A-Z0-9]+)+)\b')
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE positions (
+    position_id TEXT PRIMARY KEY,
+    ordinal INTEGER NOT NULL,
+    title TEXT,
+    domain TEXT COLLATE NOCASE,
+    text TEXT,
+    sources TEXT,
+    content_hash TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE position_works (
+    position_id TEXT NOT NULL,
+    work TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE rules (
+    rule_id TEXT PRIMARY KEY,
+    ordinal INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE tombstones (
+    seq INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX idx_positions_domain ON positions (domain);
+CREATE INDEX idx_positions_ordinal ON positions (ordinal);
+CREATE INDEX idx_position_works_work ON position_works (work);
+CREATE INDEX idx_position_works_position ON position_works (position_id);
+CREATE INDEX idx_rules_ordinal ON rules (ordinal);
+'''
+
+# Export record kinds, in the order a full export walks them
+EXPORT_KINDS = ('position', 'rule', 'deleted')
+
+
+class ResyncRequired(Exception):
+    """A sync token cannot be served as a delta: the client must re-export everything"""
+
+
+def work_id(source):
+    match = _WORK_ID.match(source.strip())
+    return match.group(1) if match else source.strip()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_fingerprint(database_path, rules_path=None):
+    fingerprint = {}
+    for prefix, path in (('source', database_path), ('rules', rules_path)):
+        if path:
+            stat = os.stat(path)
+            fingerprint.update({f'{prefix}_path': os.path.abspath(path), f'{prefix}_size': str(stat.st_size),
+                                f'{prefix}_mtime': str(int(stat.st_mtime))})
+    return fingerprint
+
+
+def content_hash(record):
+    """Stable hash of a record's content (key order and formatting do not matter)"""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _content_epoch(hashes):
+    """Identifier of a version history, derived from the content it starts from"""
+    digest = hashlib.sha1()
+    for (kind, record_id), record_hash in sorted(hashes.items()):
+        digest.update(f"{kind}\0{record_id}\0{record_hash}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _previous_history(store_path):
+    """
+    (epoch, sync_version, {(kind, id): (hash, version)}, {(kind, id): version})
+    of an existing store, so a rebuild keeps versions of unchanged records;
+    epoch is None when there is no usable previous store
+    """
+    if not os.path.exists(store_path):
+        return None, 0, {}, {}
+    try:
+        conn = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+            if meta.get('schema_version') != SCHEMA_VERSION or not meta.get('epoch'):
+                return None, 0, {}, {}
+            records = {
+                (kind, record_id): (record_hash, version)
+                for kind, record_id, record_hash, version in conn.execute(
+                    "SELECT 'position', position_id, content_hash, version FROM positions "
+                    "UNION ALL SELECT 'rule', rule_id, content_hash, version FROM rules")
+            }
+            tombstones = {(kind, record_id): version for kind, record_id, version in
+                          conn.execute('SELECT kind, record_id, version FROM tombstones ORDER BY seq')}
+            return meta['epoch'], int(meta.get('sync_version', 0)), records, tombstones
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None, 0, {}, {}
+
+
+def _load_rules(rules_path):
+    if not rules_path:
+        return []
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    seen_ids = set()
+    unique = []
+    for rule in rules:
+        if rule.get('id') and rule['id'] not in seen_ids:
+            unique.append(rule)
+            seen_ids.add(rule['id'])
+    return unique
+
+
+def build_store(database_path, store_path=DEFAULT_PATH, rules_path=None):
+    """
+    Parse database_path (and rules_path) and write a fresh store, atomically
+    replacing store_path
+
+    Records whose content hash is unchanged keep their version from the previous
+    store; changed, new and removed records get the next sync version.
+
+    Without a previous store (first build, or a fresh disk after a deploy) a new
+    history starts at version 1 under an epoch derived from the content, so the
+    same data always yields the same epoch and a different epoch tells mirrors
+    that their sync token is from another history.
+    """
+    print(f"Building position store {store_path} from {database_path}...")
+    with open(database_path, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+    positions = parse_positions(db)
+    metadata = db.get('database_metadata', {}) if isinstance(db.get('database_metadata'), dict) else {}
+    database_version = str(metadata.get('version') or db.get('version') or '')
+    rules = _load_rules(rules_path)
+
+    epoch, previous_version, previous_records, previous_tombstones = _previous_history(store_path)
+    next_version = previous_version + 1
+    hashes = {('position', p['position_id']): content_hash(p) for p in positions}
+    hashes.update((('rule', r['id']), content_hash(r)) for r in rules)
+    if epoch is None:
+        epoch = _content_epoch(hashes)
+    deleted = [key for key in previous_records if key not in hashes]
+    changed = bool(deleted) or any(previous_records.get(key, (None,))[0] != h for key, h in hashes.items())
+    sync_version = next_version if changed else max(previous_version, 1)
+
+    def version_of(key):
+        previous = previous_records.get(key)
+        return previous[1] if previous and previous[0] == hashes[key] else sync_version
+
+    tombstones = {key: version for key, version in previous_tombstones.items() if key not in hashes}
+    tombstones.update((key, sync_version) for key in deleted)
+
+    os.makedirs(os.path.dirname(store_path) or '.', exist_ok=True)
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            'INSERT INTO positions (position_id, ordinal, title, domain, text, sources, content_hash, version) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((p['position_id'], i, p['title'], p['domain'], p['text'], json.dumps(p['source']),
+              hashes[('position', p['position_id'])], version_of(('position', p['position_id'])))
+             for i, p in enumerate(positions))
+        )
+        conn.executemany(
+            'INSERT INTO position_works (position_id, work) VALUES (?, ?)',
+            ((p['position_id'], work) for p in positions
+             for work in sorted({work_id(str(s)) for s in p['source'] if s}))
+        )
+        conn.executemany(
+            'INSERT INTO rules (rule_id, ordinal, data, content_hash, version) VALUES (?, ?, ?, ?, ?)',
+            ((r['id'], i, json.dumps(r, ensure_ascii=False), hashes[('rule', r['id'])], version_of(('rule', r['id'])))
+             for i, r in enumerate(rules))
+        )
+        conn.executemany(
+            'INSERT INTO tombstones (kind, record_id, version) VALUES (?, ?, ?)',
+            ((kind, record_id, version) for (kind, record_id), version in
+             sorted(tombstones.items(), key=lambda item: item[1]))
+        )
+        meta = {
+            **_source_fingerprint(database_path, rules_path),
+            'source_sha256': _file_sha256(database_path),
+            'database_version': database_version,
+            'schema_version': SCHEMA_VERSION,
+            'epoch': epoch,
+            'sync_version': str(sync_version),
+            'position_count': str(len(positions)),
+            'rule_count': str(len(rules)),
+            'built_at': datetime.now().isoformat()
+        }
+        conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', meta.items())
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, store_path)
+    print(f"✓ Position store built with {len(positions)} positions and {len(rules)} rules "
+          f"(sync token {epoch}.{sync_version})")
+
+
+class PositionStore:
+    """
+    Read-only access to a built store; one SQLite connection per thread and process
+
+    Connections are opened lazily, so a store created in a preloading gunicorn
+    master holds none at fork time, and a connection opened before a fork is
+    never reused in the child (SQLite connections must not cross fork()).
+    """
+
+    def __init__(self, store_path=DEFAULT_PATH):
+        self.store_path = store_path
+        self._local = threading.local()
+        conn = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+        try:
+            self.meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+        finally:
+            conn.close()
+
+    @classmethod
+    def open(cls, database_path, store_path=DEFAULT_PATH, rules_path=None):
+        """Open store_path, rebuilding it first if it is missing or was built from other files"""
+        if not cls._is_current(database_path, store_path, rules_path):
+            build_store(database_path, store_path, rules_path)
+        return cls(store_path)
+
+    @staticmethod
+    def _is_current(database_path, store_path, rules_path=None):
+        if not os.path.exists(store_path):
+            return False
+        try:
+            conn = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+            try:
+                meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        expected = {**_source_fingerprint(database_path, rules_path), 'schema_version': SCHEMA_VERSION}
+        if not rules_path and meta.get('rules_path'):
+            return False
+        return all(meta.get(k) == v for k, v in expected.items())
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # A connection inherited from the parent process is dropped, not closed or used
+            conn = sqlite3.connect(f"file:{self.store_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row(row):
+        return {
+            'position_id': row['position_id'],
+            'title': row['title'],
+            'domain': row['domain'],
+            'text': row['text'],
+            'source': json.loads(row['sources'])
+        }
+
+    def __len__(self):
+        return int(self.meta.get('position_count', 0))
+
+    @property
+    def sync_version(self):
+        return int(self.meta.get('sync_version', 0))
+
+    @property
+    def epoch(self):
+        return self.meta.get('epoch', '')
+
+    @property
+    def sync_token(self):
+        """'<epoch>.<version>': what a mirror stores and sends back as `since`"""
+        return f"{self.epoch}.{self.sync_version}"
+
+    def since_version(self, token):
+        """
+        Version to export changes after, for a sync token from a previous export
+
+        Raises:
+            ValueError: malformed token
+            ResyncRequired: token from another history (rebuilt store, new data)
+                or ahead of this store
+        """
+        epoch, _, version = str(token).rpartition('.')
+        if not epoch or not version.isdigit():
+            raise ValueError(f"Malformed sync token: {token!r}")
+        if epoch != self.epoch:
+            raise ResyncRequired(f"sync token is from another store history (current {self.sync_token})")
+        if int(version) > self.sync_version:
+            raise ResyncRequired(f"sync token is ahead of the store (current {self.sync_token})")
+        return int(version)
+
+    def get(self, position_id):
+        row = self._conn().execute('SELECT * FROM positions WHERE position_id = ?', (position_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def get_many(self, position_ids):
+        """Positions in the requested order (duplicates collapsed), plus the ids that were not found"""
+        wanted = list(dict.fromkeys(position_ids))
+        found = {}
+        for start in range(0, len(wanted), MAX_PARAMS):
+            chunk = wanted[start:start + MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self._conn().execute(f'SELECT * FROM positions WHERE position_id IN ({placeholders})', chunk):
+                found[row['position_id']] = self._row(row)
+        return [found[pid] for pid in wanted if pid in found], [pid for pid in wanted if pid not in found]
+
+    def find(self, domain=None, work=None, limit=50, offset=0):
+        """Positions filtered by domain and/or source work (case-insensitive), in database order"""
+        sql = 'SELECT p.* FROM positions p'
+        clauses, params = [], []
+        if work:
+            sql += ' JOIN position_works w ON w.position_id = p.position_id'
+            clauses.append('w.work = ?')
+            params.append(work)
+        if domain:
+            clauses.append('p.domain = ?')
+            params.append(domain)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' GROUP BY p.position_id ORDER BY p.ordinal LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
+        return [self._row(row) for row in self._conn().execute(sql, params)]
+
+    def export(self, kind, after=-1, since=0, limit=1000):
+        """
+        Yield (ordinal, record) for one export kind in stable order, lazily from
+        a SQLite cursor: records with ordinal > after whose version > since
+
+        Records carry 'hash' and 'version'; 'deleted' records are tombstones
+        for positions/rules removed after version `since`.
+        """
+        conn = self._conn()
+        if kind == 'position':
+            rows = conn.execute(
+                'SELECT * FROM positions WHERE ordinal > ? AND version > ? ORDER BY ordinal LIMIT ?',
+                (after, since, limit))
+            for row in rows:
+                yield row['ordinal'], {'type': 'position', 'id': row['position_id'], 'hash': row['content_hash'],
+                                       'version': row['version'], 'data': self._row(row)}
+        elif kind == 'rule':
+            rows = conn.execute(
+                'SELECT * FROM rules WHERE ordinal > ? AND version > ? ORDER BY ordinal LIMIT ?',
+                (after, since, limit))
+            for row in rows:
+                yield row['ordinal'], {'type': 'rule', 'id': row['rule_id'], 'hash': row['content_hash'],
+                                       'version': row['version'], 'data': json.loads(row['data'])}
+        elif kind == 'deleted':
+            rows = conn.execute(
+                'SELECT * FROM tombstones WHERE seq > ? AND version > ? ORDER BY seq LIMIT ?',
+                (after, since, limit))
+            for row in rows:
+                yield row['seq'], {'type': 'deleted', 'kind': row['kind'], 'id': row['record_id'],
+                                   'version': row['version']}
+        else:
+            raise ValueError(f"Unknown export kind: {kind}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the indexed SQLite position store')
+    parser.add_argument('database', nargs='?', default='data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json')
+    parser.add_argument('--rules', default='kuczynski_rules_full.json', help="KIRE rules file ('' to skip)")
+    parser.add_argument('--output', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+    build_store(args.database, args.output, args.rules or None)
+
+
+if __name__ == '__main__':
+    main()
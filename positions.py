@@ -0,0 +1,78 @@
+"""
+Position database parsing
+Reads any data/ database version into the flat position dicts used by semantic
+search and the position store. Standard library only, so lightweight tools can
+import it without numpy/OpenAI.
+"""
+import json
+
+
+def parse_positions(db):
+    """
+    Normalize any database version (v17+ nested dicts or v19+ position arrays)
+    into a list of dicts with position_id, text, domain, title, source
+    """
+    positions = []
+    seen_ids = set()
+
+    # Handle new array-based format (v19 complete and v25)
+    if 'positions' in db and isinstance(db['positions'], list):
+        for pos_data in db['positions']:
+            pos_id = pos_data.get('id', '') or pos_data.get('position_id', '')
+            if pos_id and pos_id not in seen_ids:
+                position_text = (pos_data.get('text_evidence', '') or 
+                               pos_data.get('description', '') or
+                               pos_data.get('thesis', '') or 
+                               pos_data.get('position', '') or 
+                               pos_data.get('content', '') or
+                               pos_data.get('text', ''))
+                positions.append({
+                    'position_id': pos_id,
+                    'text': position_text,
+                    'domain': pos_data.get('domain', 'Unknown'),
+                    'title': pos_data.get('title', ''),
+                    'source': pos_data.get('source', []) if isinstance(pos_data.get('source'), list) else [pos_data.get('source', 'Unknown')]
+                })
+                seen_ids.add(pos_id)
+
+    # Handle old nested dictionary format (v17/v18)
+    elif 'integrated_core_positions' in db:
+        for domain, pos_dict in db['integrated_core_positions'].items():
+            for pos_id, pos_data in pos_dict.items():
+                if pos_id not in seen_ids:
+                    position_text = pos_data.get('position', '') or pos_data.get('thesis', '')
+                    positions.append({
+                        'position_id': pos_id,
+                        'text': position_text,
+                        'domain': domain,
+                        'title': pos_data.get('title', ''),
+                        'source': pos_data.get('source', []) if isinstance(pos_data.get('source'), list) else [pos_data.get('source', 'Unknown')]
+                    })
+                    seen_ids.add(pos_id)
+
+        if 'positions_detailed' in db:
+            for domain, pos_dict in db['positions_detailed'].items():
+                if isinstance(pos_dict, dict):
+                    for pos_id, pos_data in pos_dict.items():
+                        if pos_id not in seen_ids:
+                            position_text = pos_data.get('content', '') or pos_data.get('thesis', '')
+                            if 'context' in pos_data and pos_data['context']:
+                                position_text = position_text + " " + pos_data['context']
+
+                            positions.append({
+                                'position_id': pos_id,
+                                'text': position_text,
+                                'domain': domain,
+                                'title': pos_data.get('title', ''),
+                                'source': [pos_data.get('work_id', 'Unknown')]
+                            })
+                            seen_ids.add(pos_id)
+
+    return positions
+
+
+def load_positions(database_path):
+    print(f"Loading database from {database_path}...")
+    with open(database_path, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+    return parse_positions(db)
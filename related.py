@@ -0,0 +1,116 @@
+"""
+Related-positions graph
+Offline k-nearest-neighbour table over the position embeddings, computed in
+row blocks so the full N x N similarity matrix is never materialized
+
+Build:
+    python related.py [--k 10] [--output data/related_positions.npz]
+"""
+import argparse
+import os
+
+import numpy as np
+
+from search import normalize_rows
+
+DEFAULT_PATH = 'data/related_positions.npz'
+DEFAULT_K = 10
+# Upper bound on the (block_rows x N) float32 similarity block
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def build_neighbors(embeddings, k=DEFAULT_K, block_rows=None):
+    """
+    k nearest neighbours (cosine) of every row, excluding the row itself
+
+    Returns:
+        (indices, scores): int32 and float32 arrays of shape (N, k), best first
+    """
+    exact = normalize_rows(embeddings)
+    n = exact.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int32), np.empty((n, 0), dtype=np.float32)
+    if block_rows is None:
+        block_rows = max(1, BLOCK_BYTES // (4 * n))
+
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        sims = exact[start:stop] @ exact.T
+        rows = np.arange(stop - start)
+        sims[rows, rows + start] = -np.inf  # a position is not related to itself
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        indices[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+        print(f"Neighbours computed for {stop}/{n} positions", end='\r')
+    print()
+    return indices, scores
+
+
+def save_graph(path, position_ids, indices, scores):
+    """Compact on-disk table: int32 neighbour indices, float16 scores, ids for validation"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    np.savez_compressed(path, position_ids=np.array(position_ids), indices=indices,
+                        scores=scores.astype(np.float16))
+
+
+class RelatedGraph:
+    """Precomputed neighbour table aligned with SemanticSearch.positions"""
+
+    def __init__(self, position_ids, indices, scores):
+        self.position_ids = list(position_ids)
+        self.indices = indices
+        self.scores = scores
+        self.index_by_id = {pid: i for i, pid in enumerate(self.position_ids)}
+
+    @classmethod
+    def load(cls, path, positions=None):
+        """
+        Load a saved graph; returns None if it is missing or was built from a
+        different set of positions than the ones currently loaded
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            graph = cls(data['position_ids'].tolist(), data['indices'], data['scores'])
+        if positions is not None and graph.position_ids != [p['position_id'] for p in positions]:
+            print(f"⚠️  WARNING: {path} does not match the loaded positions, rebuild with `python related.py`")
+            return None
+        print(f"✓ Related-positions graph loaded ({len(graph.position_ids)} positions, k={graph.indices.shape[1]})")
+        return graph
+
+    def neighbors(self, index, limit=None):
+        """[(neighbour index, similarity)] for a row index, best first"""
+        limit = self.indices.shape[1] if limit is None else limit
+        return [(int(i), float(s)) for i, s in zip(self.indices[index, :limit], self.scores[index, :limit])]
+
+    def related(self, position_id, limit=None):
+        """[(position_id, similarity)] for a position id, or None if the id is unknown"""
+        index = self.index_by_id.get(position_id)
+        if index is None:
+            return None
+        return [(self.position_ids[i], s) for i, s in self.neighbors(index, limit)]
+
+
+def main(argv=None):
+    from search import SemanticSearch
+
+    parser = argparse.ArgumentParser(description='Precompute the related-positions graph')
+    parser.add_argument('--database', default='data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json')
+    parser.add_argument('--embeddings', default='data/position_embeddings.pkl')
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    parser.add_argument('--output', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    searcher = SemanticSearch(args.database, args.embeddings)
+    indices, scores = build_neighbors(searcher.embeddings, args.k)
+    save_graph(args.output, [p['position_id'] for p in searcher.positions], indices, scores)
+    print(f"✓ Saved {indices.shape[0]} x {indices.shape[1]} neighbour table to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
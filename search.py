@@ -1,73 +1,72 @@
-import json
 import os
 import pickle
 from openai import OpenAI
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import admission
+import metrics
+from positions import load_positions
+
+# Concurrent searches for the same query share one embeddings call
+_query_embeddings = admission.SingleFlight('embeddings')
+
+# 'float' keeps the original in-memory matrix; 'float16' / 'int8' score against a
+# compact copy and rescore the best candidates from a memory-mapped float32 file
+EMBEDDING_MODES = ('float', 'float16', 'int8')
+# Candidates rescored exactly = max(RESCORE_MIN, top_k * RESCORE_FACTOR)
+RESCORE_FACTOR = 10
+RESCORE_MIN = 100
+# Rows upcast at a time when scoring the compact matrix (bounds temporary memory)
+SCORE_BLOCK_ROWS = 16384
+
+
+def normalize_rows(matrix):
+    """float32 copy of matrix with unit-length rows (cosine similarity becomes a dot product)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(matrix, mode, block_rows=SCORE_BLOCK_ROWS):
+    """
+    Compact copy of a row-normalized float matrix
+
+    Returns:
+        (compact, scale): float16 with scale None, or int8 with a float32
+        per-row scale such that row ~= compact_row * scale
+    """
+    if mode == 'float16':
+        return np.asarray(matrix, dtype=np.float16), None
+    if mode != 'int8':
+        raise ValueError(f"Unknown embedding mode: {mode}")
+    n = matrix.shape[0]
+    compact = np.empty(matrix.shape, dtype=np.int8)
+    scale = np.empty(n, dtype=np.float32)
+    for start in range(0, n, block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        peak = np.abs(block).max(axis=1)
+        peak[peak == 0] = 1.0
+        scale[start:start + block_rows] = peak / 127.0
+        compact[start:start + block_rows] = np.rint(block / scale[start:start + block_rows, None])
+    return compact, scale
+
+
+def compact_scores(compact, scale, query, block_rows=SCORE_BLOCK_ROWS):
+    """Approximate dot products of a unit query against a quantized matrix, block by block"""
+    scores = np.empty(compact.shape[0], dtype=np.float32)
+    for start in range(0, compact.shape[0], block_rows):
+        scores[start:start + block_rows] = compact[start:start + block_rows].astype(np.float32) @ query
+    if scale is not None:
+        scores *= scale
+    return scores
+
 
 class SemanticSearch:
     """Semantic search over Kuczynski's philosophical positions"""
 
-    def __init__(self, database_path='data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json', embeddings_path='data/position_embeddings.pkl'):
-        print(f"Loading database from {database_path}...")
-        with open(database_path, 'r', encoding='utf-8') as f:
-            db = json.load(f)
-
-        self.positions = []
-        seen_ids = set()
-
-        # Handle new array-based format (v19 complete and v25)
-        if 'positions' in db and isinstance(db['positions'], list):
-            for pos_data in db['positions']:
-                pos_id = pos_data.get('id', '') or pos_data.get('position_id', '')
-                if pos_id and pos_id not in seen_ids:
-                    position_text = (pos_data.get('text_evidence', '') or 
-                                   pos_data.get('description', '') or
-                                   pos_data.get('thesis', '') or 
-                                   pos_data.get('position', '') or 
-                                   pos_data.get('content', '') or
-                                   pos_data.get('text', ''))
-                    self.positions.append({
-                        'position_id': pos_id,
-                        'text': position_text,
-                        'domain': pos_data.get('domain', 'Unknown'),
-                        'title': pos_data.get('title', ''),
-                        'source': pos_data.get('source', []) if isinstance(pos_data.get('source'), list) else [pos_data.get('source', 'Unknown')]
-                    })
-                    seen_ids.add(pos_id)
-
-        # Handle old nested dictionary format (v17/v18)
-        elif 'integrated_core_positions' in db:
-            for domain, pos_dict in db['integrated_core_positions'].items():
-                for pos_id, pos_data in pos_dict.items():
-                    if pos_id not in seen_ids:
-                        position_text = pos_data.get('position', '') or pos_data.get('thesis', '')
-                        self.positions.append({
-                            'position_id': pos_id,
-                            'text': position_text,
-                            'domain': domain,
-                            'title': pos_data.get('title', ''),
-                            'source': pos_data.get('source', []) if isinstance(pos_data.get('source'), list) else [pos_data.get('source', 'Unknown')]
-                        })
-                        seen_ids.add(pos_id)
-
-            if 'positions_detailed' in db:
-                for domain, pos_dict in db['positions_detailed'].items():
-                    if isinstance(pos_dict, dict):
-                        for pos_id, pos_data in pos_dict.items():
-                            if pos_id not in seen_ids:
-                                position_text = pos_data.get('content', '') or pos_data.get('thesis', '')
-                                if 'context' in pos_data and pos_data['context']:
-                                    position_text = position_text + " " + pos_data['context']
-
-                                self.positions.append({
-                                    'position_id': pos_id,
-                                    'text': position_text,
-                                    'domain': domain,
-                                    'title': pos_data.get('title', ''),
-                                    'source': [pos_data.get('work_id', 'Unknown')]
-                                })
-                                seen_ids.add(pos_id)
+    def __init__(self, database_path='data/KUCZYNSKI_PHILOSOPHICAL_DATABASE_v32_CONCEPTUAL_ATOMISM.json', embeddings_path='data/position_embeddings.pkl', embedding_mode=None):
+        self.positions = load_positions(database_path)
 
         # Filter out positions with empty text to keep alignment with embeddings
         original_count = len(self.positions)
@@ -77,11 +76,25 @@ class SemanticSearch:
             print(f"Filtered out {filtered_count} positions with empty text")
         
         print(f"Loaded {len(self.positions)} philosophical positions")
+        self.index_by_id = {p['position_id']: i for i, p in enumerate(self.positions)}
 
         # Initialize OpenAI client
         self.client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
 
-        if embeddings_path and os.path.exists(embeddings_path):
+        self.embedding_mode = embedding_mode or os.environ.get('EMBEDDING_MODE', 'float')
+        if self.embedding_mode not in EMBEDDING_MODES:
+            raise ValueError(f"EMBEDDING_MODE must be one of {EMBEDDING_MODES}, got {self.embedding_mode!r}")
+        self.compact = None
+        self.compact_scale = None
+        # Optional related.RelatedGraph used by search(expand=...)
+        self.graph = None
+        exact_path = self._exact_path(embeddings_path)
+
+        if self.embedding_mode != 'float' and self._exact_is_fresh(exact_path, embeddings_path):
+            # Skip unpickling the float64 matrix entirely
+            print(f"Memory-mapping full-precision embeddings from {exact_path}...")
+            self.embeddings = np.load(exact_path, mmap_mode='r')
+        elif embeddings_path and os.path.exists(embeddings_path):
             print(f"Loading pre-computed embeddings from {embeddings_path}...")
             with open(embeddings_path, 'rb') as f:
                 embeddings_data = pickle.load(f)
@@ -112,8 +125,44 @@ class SemanticSearch:
                 with open(embeddings_path, 'wb') as f:
                     pickle.dump(self.embeddings, f)
 
+        if self.embedding_mode != 'float':
+            self._build_compact(exact_path)
+
         print("Semantic search initialized successfully!")
 
+    @staticmethod
+    def _exact_path(embeddings_path):
+        if not embeddings_path:
+            return None
+        return os.path.splitext(embeddings_path)[0] + '.f32.npy'
+
+    def _exact_is_fresh(self, exact_path, embeddings_path):
+        """True if the float32 .npy exists, matches the database and is not older than the pickle"""
+        if not exact_path or not os.path.exists(exact_path):
+            return False
+        if embeddings_path and os.path.exists(embeddings_path) and os.path.getmtime(exact_path) < os.path.getmtime(embeddings_path):
+            return False
+        return np.load(exact_path, mmap_mode='r').shape[0] == len(self.positions)
+
+    def _build_compact(self, exact_path):
+        """Quantize self.embeddings and swap the full-precision matrix for a memory-mapped file"""
+        if not isinstance(self.embeddings, np.memmap):
+            exact = normalize_rows(self.embeddings)
+            if exact_path:
+                print(f"Saving full-precision embeddings to {exact_path}...")
+                # Other workers may have this file memory-mapped: never truncate it in place
+                tmp_path = f"{exact_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, exact)
+                os.replace(tmp_path, exact_path)
+                del exact
+                self.embeddings = np.load(exact_path, mmap_mode='r')
+            else:
+                self.embeddings = exact
+        self.compact, self.compact_scale = quantize(self.embeddings, self.embedding_mode)
+        print(f"Using {self.embedding_mode} embeddings for first-pass scoring "
+              f"({self.compact.nbytes / 1e6:.1f} MB in memory)")
+
     def _generate_embeddings(self, texts, batch_size=100):
         """Generate embeddings using OpenAI API in batches"""
         all_embeddings = []
@@ -127,7 +176,24 @@ class SemanticSearch:
             all_embeddings.extend([item.embedding for item in response.data])
         return np.array(all_embeddings)
 
-    def search(self, query, top_k=5, min_similarity=0.25):
+    def embed_query(self, query):
+        """
+        Embed a query, coalescing identical concurrent requests into one upstream call
+
+        Raises:
+            admission.Overloaded if the embeddings limiter sheds the request
+        """
+        def call():
+            with admission.get_limiter('embeddings').slot():
+                response = self.client.embeddings.create(
+                    model="text-embedding-3-small",
+                    input=query
+                )
+            return np.array(response.data[0].embedding)
+
+        return _query_embeddings.do(query, call)
+
+    def search(self, query, top_k=5, min_similarity=0.25, expand=0):
         """
         Find most relevant positions for query
 
@@ -135,33 +201,113 @@ class SemanticSearch:
             query: User's question or statement
             top_k: Number of results to return
             min_similarity: Minimum similarity threshold (0-1)
+            expand: Also return up to this many graph neighbours per hit
+                (requires self.graph; neighbours carry 'related_to')
 
         Returns:
             list of dicts with position_id, text, title, domain, similarity_score
         """
-        response = self.client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query
-        )
-        query_embedding = np.array(response.data[0].embedding)
+        with metrics.stage('query_embedding'):
+            query_embedding = self.embed_query(query)
 
-        similarities = cosine_similarity([query_embedding], self.embeddings)[0]
+        return self.search_embedding(query_embedding, top_k, min_similarity, expand)
 
-        valid_indices = [i for i, sim in enumerate(similarities) if sim >= min_similarity]
+    def search_embedding(self, query_embedding, top_k=5, min_similarity=0.25, expand=0, candidates=None):
+        """
+        search() for an already-computed query embedding (no network calls)
 
-        if not valid_indices:
-            print(f"Warning: No positions found with similarity >= {min_similarity}")
-            return []
+        Args:
+            candidates: Optional row indices; when given only these positions are
+                scored (used to rescore a follow-up question's neighbourhood)
+        """
+        with metrics.stage('similarity'):
+            if candidates is not None:
+                top_indices, top_scores = self._search_candidates(query_embedding, candidates, top_k, min_similarity)
+            elif self.compact is not None:
+                top_indices, top_scores = self._search_compact(query_embedding, top_k, min_similarity)
+            else:
+                similarities = cosine_similarity([query_embedding], self.embeddings)[0]
 
-        valid_similarities = similarities[valid_indices]
-        top_relative_indices = valid_similarities.argsort()[-min(top_k, len(valid_indices)):][::-1]
-        top_indices = [valid_indices[i] for i in top_relative_indices]
+                valid_indices = [i for i, sim in enumerate(similarities) if sim >= min_similarity]
+
+                valid_similarities = similarities[valid_indices]
+                top_relative_indices = valid_similarities.argsort()[-min(top_k, len(valid_indices)):][::-1]
+                top_indices = [valid_indices[i] for i in top_relative_indices]
+                top_scores = [similarities[i] for i in top_indices]
+
+            if not len(top_indices):
+                print(f"Warning: No positions found with similarity >= {min_similarity}")
+                return []
 
         results = []
-        for idx in top_indices:
+        for idx, score in zip(top_indices, top_scores):
             results.append({
                 **self.positions[idx],
-                'similarity': float(similarities[idx])
+                'similarity': float(score)
             })
 
-        return results
\ No newline at end of file
+        if expand and self.graph is not None:
+            results.extend(self._expand(query_embedding, top_indices, expand))
+
+        return results
+
+    def _cosine(self, query_embedding, indices):
+        """Exact cosine similarity between the query and the given rows"""
+        rows = np.asarray(self.embeddings[indices], dtype=np.float32)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        return rows @ query / (np.linalg.norm(rows, axis=1) * np.linalg.norm(query) + 1e-12)
+
+    def export_embedding(self, index):
+        """Unit-length float32 embedding of one position as a list, the same in every INDEX_PRECISION mode"""
+        return normalize_rows(np.asarray(self.embeddings[index])[None, :])[0].tolist()
+
+    def _search_candidates(self, query_embedding, candidates, top_k, min_similarity):
+        indices = np.unique(np.asarray(list(candidates), dtype=np.int64))
+        if not len(indices):
+            return [], []
+        scores = self._cosine(query_embedding, indices)
+        keep = scores >= min_similarity
+        indices, scores = indices[keep], scores[keep]
+        order = np.argsort(-scores)[:top_k]
+        return indices[order].tolist(), scores[order].tolist()
+
+    def _expand(self, query_embedding, hit_indices, per_hit):
+        """Graph neighbours of the hits (not already returned), scored against the query"""
+        seen = set(int(i) for i in hit_indices)
+        parents = {}
+        for idx in hit_indices:
+            for neighbor, _ in self.graph.neighbors(int(idx), per_hit):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    parents[neighbor] = self.positions[int(idx)]['position_id']
+        if not parents:
+            return []
+
+        indices = sorted(parents)
+        scores = self._cosine(query_embedding, indices)
+        expanded = [
+            {**self.positions[i], 'similarity': float(score), 'related_to': parents[i]}
+            for i, score in zip(indices, scores)
+        ]
+        expanded.sort(key=lambda r: -r['similarity'])
+        return expanded
+
+    def _search_compact(self, query_embedding, top_k, min_similarity):
+        """
+        Two-pass search: approximate scores from the compact matrix, then exact
+        cosine for the best candidates read from the memory-mapped float32 file
+        """
+        query = normalize_rows(np.asarray(query_embedding).reshape(1, -1))[0]
+        approx = compact_scores(self.compact, self.compact_scale, query)
+
+        n_candidates = min(len(approx), max(RESCORE_MIN, top_k * RESCORE_FACTOR))
+        if n_candidates == 0:
+            return [], []
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        candidates.sort()  # ascending row order keeps mmap reads sequential
+        exact = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query
+
+        keep = exact >= min_similarity
+        candidates, exact = candidates[keep], exact[keep]
+        order = np.argsort(-exact)[:top_k]
+        return candidates[order].tolist(), exact[order].tolist()
\ No newline at end of file
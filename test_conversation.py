@@ -0,0 +1,125 @@
+"""
+Tests for follow-up classification and blended retrieval in conversation.py
+Run with: python -m pytest test_conversation.py
+"""
+from contextlib import nullcontext
+
+import numpy as np
+
+import conversation
+from search import SemanticSearch
+
+PREVIOUS = conversation.RetrievalContext('What is Kant\'s categorical imperative?', np.eye(4)[0], [], [], [])
+
+REUSE = [
+    "Give me another example",
+    "more examples please",
+    "Can you give me more examples of that?",
+    "elaborate",
+    "Why?",
+    "why is that?",
+    "go on.",
+]
+BLEND = [
+    "And what about Hume?",
+    "How does that argument apply to lying?",
+    "Are those compatible with utilitarianism?",
+]
+FRESH = [
+    "Give me more examples of Kant's categorical imperative",
+    "Show me other cases where economics fails as a science",
+    "What is it like to be a bat?",
+    "Do you think that free will exists?",
+    "What is his view of the analytic-synthetic distinction?",
+]
+
+
+def test_reuse_questions():
+    for question in REUSE:
+        assert conversation.classify(question, PREVIOUS) == 'reuse', question
+
+
+def test_blend_questions():
+    for question in BLEND:
+        assert conversation.classify(question, PREVIOUS) == 'blend', question
+
+
+def test_new_content_is_fresh():
+    for question in FRESH:
+        assert conversation.classify(question, PREVIOUS) == 'fresh', question
+
+
+def test_first_turn_is_fresh():
+    assert conversation.classify("Give me another example", None) == 'fresh'
+
+
+def make_searcher(query_vectors):
+    """SemanticSearch over 10 positions on axis 0 and 10 on axis 1, with canned query embeddings"""
+    rng = np.random.default_rng(0)
+    embeddings = np.zeros((20, 4))
+    embeddings[:10, 0] = 1
+    embeddings[10:, 1] = 1
+    embeddings += rng.normal(scale=0.05, size=embeddings.shape)
+    searcher = SemanticSearch.__new__(SemanticSearch)
+    searcher.positions = [{'position_id': f'P-{i}', 'title': '', 'domain': 'ethics' if i < 10 else 'epistemology',
+                           'text': 't', 'source': []}
+                          for i in range(20)]
+    searcher.index_by_id = {p['position_id']: i for i, p in enumerate(searcher.positions)}
+    searcher.embeddings = embeddings
+    searcher.compact = None
+    searcher.graph = None
+    searcher.embed_query = lambda question: np.asarray(query_vectors[question], dtype=float)
+    return searcher
+
+
+def forbid_full_scan(searcher):
+    """Make any search_embedding call without candidates fail, as it would score the whole matrix"""
+    search_embedding = searcher.search_embedding
+
+    def candidates_only(query_embedding, candidates=None, **kwargs):
+        assert candidates is not None, 'follow-up scored the full embedding matrix'
+        return search_embedding(query_embedding, candidates=candidates, **kwargs)
+
+    searcher.search_embedding = candidates_only
+
+
+class RecordingKire:
+    """KIRE stand-in that records the rule domains each deduce call was limited to"""
+
+    def __init__(self):
+        self.calls = []
+
+    def deduce(self, phenomenon, max_rules=18, domains=None):
+        self.calls.append(domains)
+        return [{'id': f'R-{len(self.calls)}', 'strength': 1.0, 'domain': 'ethics', 'conclusion': phenomenon}]
+
+
+class NullTimer:
+    def stage(self, name):
+        return nullcontext()
+
+
+def test_blend_stays_in_previous_neighbourhood():
+    searcher = make_searcher({'first': [1, 0, 0, 0], 'And what about that argument?': [1, 0, 0.2, 0]})
+    kire = RecordingKire()
+    _, _, context, _ = conversation.retrieve(searcher, kire, 'first', None, NullTimer(), top_k=3)
+    forbid_full_scan(searcher)
+    positions, deductions, new_context, strategy = conversation.retrieve(
+        searcher, kire, 'And what about that argument?', context, NullTimer(), top_k=3)
+    assert strategy == 'blend'
+    assert new_context.turns == 2
+    assert all(searcher.index_by_id[p['position_id']] < 10 for p in positions)
+    # The full rule set runs once for the first turn; the follow-up only rechecks the ethics rules
+    assert kire.calls == [None, {'ethics'}]
+    assert {rule['id'] for rule in deductions} == {'R-1', 'R-2'}
+
+
+def test_blend_falls_back_to_fresh_search_on_topic_change():
+    searcher = make_searcher({'first': [1, 0, 0, 0], 'And what about knowledge?': [0, 1, 0, 0]})
+    _, _, context, _ = conversation.retrieve(searcher, None, 'first', None, None, top_k=3)
+    assert conversation.classify('And what about knowledge?', context) == 'blend'
+    positions, _, new_context, strategy = conversation.retrieve(searcher, None, 'And what about knowledge?',
+                                                                context, None, top_k=3)
+    assert strategy == 'fresh'
+    assert new_context.turns == 1
+    assert all(searcher.index_by_id[p['position_id']] >= 10 for p in positions)
@@ -0,0 +1,178 @@
+"""
+Tests for position_store.py delta sync: versions, tombstones and sync tokens
+across rebuilds and redeploys (a rebuild with no previous store on disk)
+Run with: python -m pytest test_position_store.py
+"""
+import json
+import os
+
+import pytest
+
+from position_store import PositionStore, ResyncRequired, build_store
+
+
+def write_sources(tmp_path, positions, rules=({'id': 'R1', 'premise': 'p', 'conclusion': 'c'},)):
+    database = tmp_path / 'database.json'
+    database.write_text(json.dumps({'positions': [
+        {'id': pid, 'title': pid, 'domain': 'epistemology', 'text': text} for pid, text in positions
+    ]}))
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text(json.dumps(list(rules)))
+    return str(database), str(rules_file)
+
+
+def build(tmp_path, positions):
+    database, rules = write_sources(tmp_path, positions)
+    store_path = str(tmp_path / 'positions.sqlite3')
+    build_store(database, store_path, rules)
+    return PositionStore(store_path)
+
+
+def export(store, kind, since):
+    return [record for _, record in store.export(kind, since=since)]
+
+
+ORIGINAL = [('EP-001', 'one'), ('EP-002', 'two'), ('EP-003', 'three')]
+EDITED = [('EP-001', 'one, revised'), ('EP-002', 'two')]
+
+
+def test_rebuild_without_changes_keeps_token(tmp_path):
+    first = build(tmp_path, ORIGINAL).sync_token
+    assert build(tmp_path, ORIGINAL).sync_token == first
+    assert first.endswith('.1')
+
+
+def test_edit_and_delete_are_a_delta(tmp_path):
+    old_token = build(tmp_path, ORIGINAL).sync_token
+    store = build(tmp_path, EDITED)
+    assert store.sync_version == 2
+    since = store.since_version(old_token)
+    assert [r['id'] for r in export(store, 'position', since)] == ['EP-001']
+    assert export(store, 'rule', since) == []
+    assert export(store, 'deleted', since) == [{'type': 'deleted', 'kind': 'position', 'id': 'EP-003', 'version': 2}]
+    assert export(store, 'position', store.since_version(store.sync_token)) == []
+
+
+def test_redeploy_with_new_data_requires_resync(tmp_path):
+    old_token = build(tmp_path, ORIGINAL).sync_token
+    os.remove(tmp_path / 'positions.sqlite3')  # ephemeral disk: the next deploy starts from nothing
+    store = build(tmp_path, EDITED)
+    assert store.sync_version == 1
+    with pytest.raises(ResyncRequired):
+        store.since_version(old_token)
+
+
+def test_redeploy_behind_a_mirror_requires_resync(tmp_path):
+    build(tmp_path, ORIGINAL)
+    ahead_token = build(tmp_path, EDITED).sync_token
+    os.remove(tmp_path / 'positions.sqlite3')
+    store = build(tmp_path, ORIGINAL)
+    with pytest.raises(ResyncRequired):
+        store.since_version(ahead_token)
+
+
+def test_redeploy_of_same_data_keeps_token(tmp_path):
+    token = build(tmp_path, ORIGINAL).sync_token
+    os.remove(tmp_path / 'positions.sqlite3')
+    store = build(tmp_path, ORIGINAL)
+    assert store.sync_token == token
+    assert export(store, 'position', store.since_version(token)) == []
+
+
+def test_malformed_token(tmp_path):
+    store = build(tmp_path, ORIGINAL)
+    for token in ('2', 'abc', f'{store.epoch}.x'):
+        with pytest.raises(ValueError):
+            store.since_version(token)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+    monkeypatch.setenv('ZHI_PRIVATE_KEY', 'secret')
+    # A searcher is set so the lazy warm-up hook does not replace the store under test
+    monkeypatch.setattr(app_module, 'searcher', object())
+    monkeypatch.setattr(app_module, 'position_store', None)
+
+    def deploy(positions, fresh_disk=False):
+        if fresh_disk and os.path.exists(tmp_path / 'positions.sqlite3'):
+            os.remove(tmp_path / 'positions.sqlite3')
+        app_module.position_store = build(tmp_path, positions)
+
+    test_client = app_module.app.test_client()
+    test_client.deploy = deploy
+    return test_client
+
+
+def get_export(client, **params):
+    response = client.get('/api/internal/export', query_string=params, headers={'Authorization': 'Bearer secret'})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()] if response.status_code == 200 else []
+    return response, lines
+
+
+def test_export_endpoint_delta_and_redeploy(client):
+    client.deploy(ORIGINAL)
+    response, lines = get_export(client, limit=2)
+    assert response.mimetype == 'application/x-ndjson'
+    assert [l['type'] for l in lines] == ['position', 'position', 'page']
+    first_page_cursor = lines[-1]['next_cursor']
+    response, rest = get_export(client, cursor=first_page_cursor)
+    assert [l['type'] for l in rest] == ['position', 'rule', 'page']
+    assert rest[-1]['next_cursor'] is None
+    token = rest[-1]['sync_token']
+
+    client.deploy(EDITED)
+    response, _ = get_export(client, cursor=first_page_cursor)
+    assert response.status_code == 409  # cursor from before the rebuild
+    response, lines = get_export(client, since=token)
+    assert [(l['type'], l['id']) for l in lines[:-1]] == [('position', 'EP-001'), ('deleted', 'EP-003')]
+
+    client.deploy(ORIGINAL, fresh_disk=True)
+    response, _ = get_export(client, since=lines[-1]['sync_token'])
+    assert response.status_code == 410
+    response, lines = get_export(client)
+    assert response.json is None and lines[-1]['sync_token'].endswith('.1')
+
+    response, _ = get_export(client, since='2')
+    assert response.status_code == 400
+
+
+def test_export_full_last_page_has_no_cursor(client):
+    client.deploy(ORIGINAL)
+    _, lines = get_export(client, kinds='position', limit=3)
+    assert [l['type'] for l in lines] == ['position'] * 3 + ['page']
+    assert lines[-1]['next_cursor'] is None
+    _, lines = get_export(client, limit=3)
+    _, rest = get_export(client, cursor=lines[-1]['next_cursor'])
+    assert [l['type'] for l in rest] == ['rule', 'page']
+    assert rest[-1]['next_cursor'] is None
+
+
+def test_export_embeddings_are_unit_float32_in_every_mode(client, monkeypatch):
+    import numpy as np
+    import app as app_module
+    from search import SemanticSearch, normalize_rows
+    client.deploy(ORIGINAL)
+    raw = np.array([[3.0, 4.0], [1.0, 0.0], [0.1, 0.3]])
+    vectors = []
+    # 'float' keeps the pickled float64 rows; the compact modes keep a normalized float32 matrix
+    for embeddings in (raw, normalize_rows(raw)):
+        searcher = SemanticSearch.__new__(SemanticSearch)
+        searcher.index_by_id = {pid: i for i, (pid, _) in enumerate(ORIGINAL)}
+        searcher.embeddings = embeddings
+        monkeypatch.setattr(app_module, 'searcher', searcher)
+        _, lines = get_export(client, kinds='position', embeddings=1)
+        vectors.append([l['embedding'] for l in lines[:-1]])
+    assert vectors[0] == vectors[1]
+    assert vectors[0][0] == np.array([0.6, 0.8], dtype=np.float32).tolist()
+
+
+def test_positions_endpoint_rejects_non_object_bodies(client):
+    client.deploy(ORIGINAL)
+    for body in ('x', ['EP-001'], 3):
+        response = client.post('/api/positions', json=body)
+        assert response.status_code == 400, body
+        assert response.json['error'] == 'Invalid request'
+    response = client.post('/api/positions', json={'ids': ['EP-001', 'EP-404']})
+    assert [p['position_id'] for p in response.json['positions']] == ['EP-001']
+    assert response.json['missing'] == ['EP-404']